@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""Measures what a poll costs, against local stand-ins for Jenkins and Gerrit.
+
+The fake servers are scripted by job count, open change count, latency per
+request and padding per job/change, or replay recorded responses. Each
+benchmark reports wall time, request count, bytes sent by the servers and
+the peak RSS of the process so far (so run the sizes in rising order)."""
+import BaseHTTPServer
+import SocketServer
+import argparse
+import json
+import resource
+import threading
+import time
+import urlparse
+
+import gerrit
+import http_session
+import jenkins_status
+import monitor_status
+import mondrian
+
+JENKINS_RESULTS = (jenkins_status.SUCCESS, jenkins_status.SUCCESS, jenkins_status.SUCCESS,
+                   jenkins_status.UNSTABLE, jenkins_status.FAILURE, jenkins_status.ABORTED)
+GERRIT_PAGE_SIZE = 500
+GERRIT_LIMITS = {'good': 0, 'almost_good': 10, 'almost_bad': 20}
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves the body respond(server, url) returns for each GET of the parsed
+       url, or a 404 for None."""
+    daemon_threads = True
+
+    def __init__(self, respond, latency=0.0, replay=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeHandler)
+        self.respond = respond
+        self.latency = latency
+        self.replay = replay  # Request path -> recorded response body
+        self.lock = threading.Lock()
+        self.reset_counters()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def count(self, body):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += len(body)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1  # One write per response, like a real server
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.server.replay is not None:
+            body = self.server.replay.get(self.path)
+        else:
+            body = self.server.respond(self.server, urlparse.urlparse(self.path))
+        if body is None:
+            self.send_error(404)
+            return
+        self.server.count(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def jenkins_response(server, url):
+    """Serves the tree API request of the bulk fetch mode."""
+    if url.path != '/api/json':
+        return None
+    jobs = [{'name': name,
+             'description': 'x' * server.padding,
+             'lastCompletedBuild': {'result': JENKINS_RESULTS[i % len(JENKINS_RESULTS)],
+                                    'number': i},
+             'lastBuild': {'building': False, 'timestamp': 0, 'estimatedDuration': 0}}
+            for (i, name) in enumerate(server.job_names)]
+    return json.dumps({'jobs': jobs})
+
+
+def gerrit_response(server, url):
+    """Serves change queries, pages of GERRIT_PAGE_SIZE changes with labels,
+       and change details. Every third change has a Code-Review vote."""
+    if url.path.endswith('/detail'):
+        number = int(url.path.split('/')[-2])
+        return ")]}'\n" + json.dumps(server.changes[number])
+    if url.path.rstrip('/') != '/changes':
+        return None
+    query = urlparse.parse_qs(url.query)
+    start = int(query.get('S', ['0'])[0])
+    results = [gerrit_query(server, q, start) for q in query.get('q', [])]
+    return ")]}'\n" + json.dumps(results if len(results) > 1 else results[0])
+
+
+def gerrit_query(server, q, start):
+    changes = server.changes
+    if q.startswith('-age:'):
+        changes = []  # Nothing updated since the last poll
+    elif q == gerrit.READY_FOR_REVIEW_QUERY:
+        changes = [c for c in changes if not c['labels']['Code-Review']]
+    elif q == gerrit.REVIEWED_QUERY:
+        changes = [c for c in changes if c['labels']['Code-Review']]
+    page = [dict(c) for c in changes[start:start + GERRIT_PAGE_SIZE]]
+    if start + GERRIT_PAGE_SIZE < len(changes):
+        page[-1]['_more_changes'] = True
+    return page
+
+
+def fake_jenkins(job_count, latency=0.0, padding=0, replay=None):
+    server = FakeServer(jenkins_response, latency, replay)
+    server.job_names = ['job-%d' % i for i in range(job_count)]
+    server.padding = padding
+    return server
+
+
+def fake_gerrit(change_count, latency=0.0, padding=0, replay=None):
+    server = FakeServer(gerrit_response, latency, replay)
+    server.changes = [{'id': str(i),
+                       'subject': 'Change %d %s' % (i, 'x' * padding),
+                       'status': 'NEW',
+                       'updated': '2015-11-29 12:00:00.000000000',
+                       'labels': {'Code-Review': {'approved': {}} if i % 3 == 0 else {}}}
+                      for i in range(change_count)]
+    return server
+
+
+def load_replay(file_name):
+    """Recorded responses: a JSON object mapping request paths (with query) to
+       response bodies, e.g. {"/api/json?tree=...": "{\"jobs\": [...]}"}."""
+    if not file_name:
+        return None
+    with open(file_name) as replay_file:
+        return json.load(replay_file)
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(name, servers, func):
+    for server in servers:
+        server.reset_counters()
+    t0 = time.time()
+    func()
+    wall_time = time.time() - t0
+    return {'benchmark': name,
+            'wall_time': wall_time,
+            'requests': sum(s.requests for s in servers),
+            'bytes': sum(s.bytes_sent for s in servers),
+            'peak_rss_kb': peak_rss_kb()}
+
+
+def monitor_cycle(jenkins, gerrit_instance):
+    """Runs a MonitorThread until it has published the last panel of its first poll.
+       Returns the stopped thread, for the caller to join outside of the measurement."""
+    done = threading.Event()
+
+    def publish(topic, **kwargs):
+        if topic in (monitor_status.UPDATE_GERRIT_REVIEWED_PUBSUB, monitor_status.SHUTDOWN_PUBSUB):
+            done.set()
+    monitor = mondrian.MonitorThread(jenkins, gerrit_instance, GERRIT_LIMITS, GERRIT_LIMITS,
+                                     publish=publish)
+    done.wait()
+    monitor.stop()
+    return monitor
+
+
+def run_benchmarks(size, args):
+    jenkins_server = fake_jenkins(size, args.latency, args.padding, load_replay(args.jenkins_replay))
+    gerrit_server = fake_gerrit(size, args.latency, args.padding, load_replay(args.gerrit_replay))
+    job_names = jenkins_server.job_names
+    groups = (job_names[0::3], job_names[1::3], job_names[2::3])
+    jenkins_session = http_session.HttpSession()
+    gerrit_session = http_session.HttpSession()
+    results = []
+    try:
+        jenkins = jenkins_status.JenkinsStatus(jenkins_server.url(), *groups, session=jenkins_session)
+        results.append(measure('jenkins get_status', [jenkins_server],
+                               lambda: jenkins.get_status(job_names)))
+
+        for query_mode in (gerrit.QUERY_MODE_LABELS, gerrit.QUERY_MODE_SPLIT, gerrit.QUERY_MODE_DETAIL):
+            gerrit_instance = gerrit.Gerrit(gerrit_server.url(), query_mode=query_mode,
+                                            session=gerrit_session)
+            results.append(measure('gerrit all_open_changes (%s)' % query_mode, [gerrit_server],
+                                   gerrit_instance.all_open_changes))
+
+        jenkins = jenkins_status.JenkinsStatus(jenkins_server.url(), *groups, session=jenkins_session)
+        gerrit_instance = gerrit.Gerrit(gerrit_server.url(), session=gerrit_session)
+        monitors = []
+        results.append(measure('monitor cycle', [jenkins_server, gerrit_server],
+                               lambda: monitors.append(monitor_cycle(jenkins, gerrit_instance))))
+        monitors[0].join()
+    finally:
+        # The kept-alive connections first, so that the handler threads are done
+        jenkins_session.close()
+        gerrit_session.close()
+        jenkins_server.stop()
+        gerrit_server.stop()
+    for result in results:
+        result['size'] = size
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark polling against fake Jenkins and Gerrit servers.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='*', default=[10, 100, 1000],
+                        help='Number of jobs and of open changes, one benchmark run per size.')
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='Seconds of latency per request.')
+    parser.add_argument('-p', '--padding', type=int, default=0,
+                        help='Extra bytes per job and change, to scale the payloads.')
+    parser.add_argument('--jenkins-replay', help='Serve recorded Jenkins responses from this file.')
+    parser.add_argument('--gerrit-replay', help='Serve recorded Gerrit responses from this file.')
+    parser.add_argument('-o', '--output', help='Also write the results as JSON to this file.')
+    args = parser.parse_args()
+
+    all_results = []
+    print '%6s  %-36s %9s %9s %11s %12s' % ('size', 'benchmark', 'seconds', 'requests', 'bytes',
+                                             'peak RSS kB')
+    for size in sorted(args.sizes):
+        for r in run_benchmarks(size, args):
+            print '%6d  %-36s %9.3f %9d %11d %12d' % (r['size'], r['benchmark'], r['wall_time'],
+                                                       r['requests'], r['bytes'], r['peak_rss_kb'])
+            all_results.append(r)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(all_results, output_file, indent=2)
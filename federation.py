@@ -0,0 +1,197 @@
+"""Several Jenkins masters, or several Gerrit servers, polled concurrently and
+presented to the monitor as one JenkinsStatus or Gerrit."""
+import logging
+import time
+import urlparse
+
+import idle
+
+
+class ServersFailed(Exception):
+    """Some servers could not be polled, and have no recent results to stand in.
+       partial is the merged result of the others."""
+
+    def __init__(self, message, partial=None):
+        Exception.__init__(self, message)
+        self.partial = partial
+
+
+class AllServersFailed(ServersFailed):
+    pass
+
+
+class Member(object):
+    """One server of a federation, polled through its own guard and at most
+       every interval seconds. Between its polls, and for a while after a failed
+       one, its last results are used."""
+
+    def __init__(self, source, guard, interval=0):
+        self.source = source
+        self.guard = guard
+        self.interval = interval
+        self.results = {}  # Kind of poll -> (time, result)
+
+
+def sources(instance):
+    """The JenkinsStatus or Gerrit instances of a federation, or the instance itself."""
+    if isinstance(instance, Federation):
+        return [member.source for member in instance.members]
+    return [instance]
+
+
+class Federation(object):
+
+    def __init__(self, members, cache=None):
+        self.members = members
+        self.cache = cache
+        self.session = None  # Each member has its own
+        self.pool = None
+
+    def get_pool(self):
+        if not self.pool:
+            self.pool = idle.WorkerPool(len(self.members), 'federation')
+        return self.pool
+
+    def poll_member(self, member, kind, poll):
+        previous = member.results.get(kind)
+        if previous and time.time() - previous[0] < member.interval:
+            return previous[1]
+        try:
+            result = member.guard.call(lambda: poll(member.source))
+        except Exception as e:
+            logging.warning('%s poll failed:\n%s', member.guard.name, str(e))
+            if previous and not member.guard.is_stale():
+                return previous[1]
+            return None
+        member.results[kind] = (time.time(), result)
+        return result
+
+    def poll_all(self, kind, poll, merge):
+        """Calls poll(source) for all members at the same time, and returns
+           merge(results). If any of them has none, ServersFailed is raised with
+           the merge of the others: it would look fine without e.g. the failing
+           jobs of a server that is down, but what it shows bad stays bad."""
+        results = self.get_pool().map(lambda member: self.poll_member(member, kind, poll), self.members)
+        missing = [member.guard.name for (member, result) in zip(self.members, results) if result is None]
+        if len(missing) == len(self.members):
+            raise AllServersFailed('none of the servers could be polled')
+        if missing:
+            raise ServersFailed('could not poll %s' % ', '.join(missing),
+                                merge([result for result in results if result is not None]))
+        return merge(results)
+
+
+def merge_statuses(status_tuples):
+    """Merges (successes, unstable, failures, aborted, not_run) tuples."""
+    merged = ([], [], [], [], [])
+    for statuses in status_tuples:
+        for (jobs, more_jobs) in zip(merged, statuses):
+            jobs.extend(more_jobs)
+    return merged
+
+
+def merge_all_statuses(results):
+    """Merges the (build, CI test, other tests) status tuples of get_all_status."""
+    return tuple(merge_statuses(result[i] for result in results) for i in range(3))
+
+
+def merge_changes(results):
+    """Merges the (for review, reviewed) changes of all_open_changes."""
+    return (sum((for_review for (for_review, _) in results), []),
+            sum((reviewed for (_, reviewed) in results), []))
+
+
+def unique(lists):
+    merged = []
+    seen = set()
+    for items in lists:
+        for item in items:
+            if item not in seen:
+                seen.add(item)
+                merged.append(item)
+    return merged
+
+
+class JenkinsFederation(Federation):
+    """Jobs of several Jenkins masters, each job group gathering the groups of all of them."""
+
+    def __init__(self, members, cache=None):
+        Federation.__init__(self, members, cache)
+        self.workers = len(members)  # Makes MonitorThread poll all groups at once
+
+    @property
+    def build_jobs(self):
+        return unique(m.source.build_jobs for m in self.members)
+
+    @property
+    def ci_test_jobs(self):
+        return unique(m.source.ci_test_jobs for m in self.members)
+
+    @property
+    def other_test_jobs(self):
+        return unique(m.source.other_test_jobs for m in self.members)
+
+    def get_build_status(self):
+        return self.poll_all('build', lambda source: source.get_build_status(), merge_statuses)
+
+    def get_ci_test_status(self):
+        return self.poll_all('ci_test', lambda source: source.get_ci_test_status(), merge_statuses)
+
+    def get_other_tests_status(self):
+        return self.poll_all('other_tests', lambda source: source.get_other_tests_status(), merge_statuses)
+
+    def get_all_status(self):
+        return self.poll_all('all', lambda source: source.get_all_status(), merge_all_statuses)
+
+    def get_time_to_finish(self, jobs):
+        times = [m.source.get_time_to_finish(jobs) for m in self.members]
+        times = [t for t in times if t is not None]
+        return min(times) if times else None
+
+    def own_jobs(self, source, jobs):
+        return [job for job in jobs
+                if job in source.build_jobs or job in source.ci_test_jobs or job in source.other_test_jobs]
+
+    def record_result(self, jenkins_job, status, number=None):
+        for member in self.members:
+            if self.own_jobs(member.source, [jenkins_job]):
+                member.source.record_result(jenkins_job, status, number)
+
+    def seed_history(self):
+        for member in self.members:
+            member.source.seed_history()
+
+    def get_history(self, jobs):
+        history = {}
+        for member in self.members:
+            history.update(member.source.get_history(self.own_jobs(member.source, jobs)))
+        return history
+
+    def get_known_status(self, jobs):
+        return merge_statuses(m.source.get_known_status(self.own_jobs(m.source, jobs))
+                              for m in self.members)
+
+    def get_all_jobs(self):
+        all_jobs = []
+        for member in self.members:
+            all_jobs.extend(member.source.get_all_jobs())
+        return all_jobs
+
+
+class GerritFederation(Federation):
+    """Open changes of several Gerrit servers."""
+
+    def all_open_changes(self):
+        return self.poll_all('open', lambda source: source.all_open_changes(), merge_changes)
+
+    def indexed_changes(self):
+        return merge_changes([m.source.indexed_changes() for m in self.members])
+
+    def apply_event(self, event):
+        """Applies a stream-events event to the index of the server of its change,
+           known from the host of the change url."""
+        host = urlparse.urlparse(event.get('change', {}).get('url', '')).netloc
+        for member in self.members:
+            if host and urlparse.urlparse(member.source.gerrit_url).netloc == host:
+                return member.source.apply_event(event)
+        return False
@@ -1,31 +1,142 @@
-import urllib2
-import json
+import urllib
+import time
+import threading
 import argparse
 
+import http_session
+import json_stream
+import metrics
+import response_cache
+
 # NOTE: Gerrit returns JSON with some leading magic characters, see
 # http://gerrit-documentation.googlecode.com/svn/Documentation/2.5/rest-api.html#output
 
+OPEN_CHANGES_QUERY = 'status:open'
+# Server side equivalents of is_ready_for_review and is_reviewed
+READY_FOR_REVIEW_QUERY = 'status:open -label:Code-Review>=1 -label:Code-Review<=-1'
+REVIEWED_QUERY = 'status:open (label:Code-Review>=1 OR label:Code-Review<=-1)'
+
+# How the open changes are classified:
+#  'detail' - one detail request per open change (the original behaviour)
+#  'labels' - labels are fetched inline with the change list, one request per page
+#  'split'  - Gerrit does the classification, both queries in one request per page
+QUERY_MODE_DETAIL = 'detail'
+QUERY_MODE_LABELS = 'labels'
+QUERY_MODE_SPLIT = 'split'
+
+# Incremental polling: query only the changes updated since the last sync
+# (plus a margin for clock skew), with a full resync now and then.
+AGE_MARGIN = 60
+FULL_RESYNC_SECONDS = 3600
+OPEN_STATUSES = ('NEW', 'DRAFT')
+
+FOR_REVIEW = 'for_review'
+REVIEWED = 'reviewed'
+
+# stream-events types, see
+# https://gerrit-review.googlesource.com/Documentation/cmd-stream-events.html
+CLOSING_EVENTS = ('change-merged', 'change-abandoned', 'change-deleted')
+# The events that may change the open changes or their Code-Review votes, others
+# (e.g. ref-updated or topic-changed) leave the panels as they are
+CHANGE_EVENTS = CLOSING_EVENTS + ('patchset-created', 'comment-added', 'change-restored',
+                                  'vote-deleted', 'reviewer-deleted', 'draft-published')
+
+
+class ChangeIndex(object):
+    """The open changes, by change id, with their review classification,
+       subject and last 'updated' time."""
+
+    def __init__(self):
+        self.changes = {}  # id -> (classification, updated, subject)
+        self.last_sync = None
+        self.last_full_sync = None
+
+    def update(self, change_id, classification, updated, info):
+        self.changes[change_id] = (classification, updated, info)
+
+    def remove(self, change_id):
+        self.changes.pop(change_id, None)
+
+    def clear(self):
+        self.changes = {}
+
+    def classified(self, classification):
+        """The stored info of the changes with the classification, latest updated first."""
+        matching = [(updated, info) for (c, updated, info) in self.changes.values()
+                    if c == classification]
+        return [info for (_, info) in sorted(matching, reverse=True)]
+
 
 class Gerrit(object):
 
-    def __init__(self, base_url=None):
+    def __init__(self, base_url=None, query_mode=QUERY_MODE_LABELS, session=None, cache=None,
+                 incremental=False):
         self.gerrit_url = base_url
         self.server = None
+        self.query_mode = query_mode
+        self.session = session or http_session.HttpSession()
+        self.cache = cache or response_cache.ResponseCache()
+        self.incremental = incremental  # Only used with the 'labels' query mode
+        self.index = ChangeIndex()
+        self.index_lock = threading.Lock()  # Polls and pushed events both update the index
 
     def open_changes_url(self):
         return '%s/%s' % (self.gerrit_url, 'changes/?q=status:open')
 
+    def query_url(self, queries, options=None, start=0):
+        params = [('q', q) for q in queries]
+        params += [('o', o) for o in (options or [])]
+        if start:
+            params.append(('S', start))
+        return '%s/changes/?%s' % (self.gerrit_url, urllib.urlencode(params))
+
     def change_detail_url(self, change_id):
         url_suffix = 'changes/%s/detail' % change_id
         return '%s/%s' % (self.gerrit_url, url_suffix)
 
-    def get_response(self, specific_url):
-        req = urllib2.Request(specific_url)
-        req.add_header('Accept', 'application/json')
-        res = urllib2.urlopen(req)
-        s = res.read()
-        all_changes = json.loads(s[5:])  # Skip leading magic characters
-        return all_changes
+    def get_response(self, specific_url, version=None):
+        with metrics.timer('gerrit_get_response_seconds'):
+            return self.cache.fetch(self.session, specific_url, self.parse_response,
+                                    {'Accept': 'application/json'}, version)
+
+    def parse_response(self, body):
+        return json_stream.loads(body, json_stream.XSSI_PREFIX)
+
+    def get_changes(self, specific_url, multiple_queries=False):
+        """The changes of a page, as compact_changes, or with multiple_queries a
+           list of them, one per query. The changes are decoded one at a time as
+           the response arrives, and only what the monitor needs of them is kept,
+           also when cached."""
+        def parse_queries(chunks):
+            reader = json_stream.StreamReader(chunks, json_stream.XSSI_PREFIX)
+            return list(reader.items(lambda: self.compact_changes(reader.items())))
+
+        def parse_changes(chunks):
+            reader = json_stream.StreamReader(chunks, json_stream.XSSI_PREFIX)
+            return self.compact_changes(reader.items())
+
+        with metrics.timer('gerrit_get_response_seconds'):
+            return self.cache.fetch(self.session, specific_url,
+                                    parse_queries if multiple_queries else parse_changes,
+                                    {'Accept': 'application/json'}, stream=True)
+
+    def compact_changes(self, changes_json):
+        """Returns ([(id, status, classification, updated, info)], more) of the
+           changes, where more tells if there is another page of them. Only open
+           changes with labels are classified. Only these are built from the
+           streamed response, never the whole JSON of it; they are kept by the
+           cache when the response can be revalidated or has a TTL, and by the
+           index."""
+        changes = []
+        more = False
+        for change_json in changes_json:
+            status = change_json.get('status', 'NEW')
+            labels = change_json.get('labels')
+            classification = self.classify(labels) if labels is not None and status in OPEN_STATUSES else None
+            changes.append((change_json['id'], status, classification, change_json.get('updated'),
+                            self.info_to_store(change_json)))
+            more = change_json.get('_more_changes', False)
+        return (changes, more)
 
     def is_ready_for_review(self, labels_json):
         return 'approved' not in labels_json['Code-Review'] and \
@@ -40,16 +151,131 @@ class Gerrit(object):
     def info_to_store(self, change_json):
         return change_json['subject']
 
+    def classify(self, labels_json):
+        if self.is_ready_for_review(labels_json):
+            return FOR_REVIEW
+        elif self.is_reviewed(labels_json):
+            return REVIEWED
+        return None
+
+    def query_changes(self, query, options=None, start=0):
+        """Yields (id, status, classification, updated, info) of all changes
+           matching the query, following Gerrit's paging (the last change of a
+           page is flagged with _more_changes)."""
+        while True:
+            (changes, more) = self.get_changes(self.query_url([query], options, start))
+            for change in changes:
+                yield change
+            if not changes or not more:
+                break
+            start += len(changes)
+
+    def query_many(self, queries, options=None):
+        """Runs several queries in one request. Returns one list of changes per
+           query, as query_changes; any query with more pages is continued on its own."""
+        if len(queries) == 1:
+            results = [self.get_changes(self.query_url(queries, options))]
+        else:
+            results = self.get_changes(self.query_url(queries, options), multiple_queries=True)
+        all_results = []
+        for (query, (changes, more)) in zip(queries, results):
+            if changes and more:
+                changes = changes + list(self.query_changes(query, options, start=len(changes)))
+            all_results.append(changes)
+        return all_results
+
     def all_open_changes(self):
+        if self.query_mode == QUERY_MODE_SPLIT:
+            return self.split_open_changes()
+        elif self.query_mode == QUERY_MODE_DETAIL:
+            return self.detailed_open_changes()
+        elif self.incremental:
+            return self.indexed_open_changes()
+        for_review = []
+        reviewed = []
+        for (_, _, classification, _, info) in self.query_changes(OPEN_CHANGES_QUERY, ['LABELS']):
+            if classification == FOR_REVIEW:
+                for_review.append(info)
+            elif classification == REVIEWED:
+                reviewed.append(info)
+        return (for_review, reviewed)
+
+    def indexed_open_changes(self):
+        self.sync_index()
+        return self.indexed_changes()
+
+    def indexed_changes(self):
+        with self.index_lock:
+            return (self.index.classified(FOR_REVIEW), self.index.classified(REVIEWED))
+
+    def sync_index(self):
+        with self.index_lock:
+            self.sync_index_unlocked()
+
+    def sync_index_unlocked(self):
+        """Brings the index up to date. Only changes updated since the last sync
+           are fetched and reclassified, merged and abandoned ones are dropped."""
+        sync_time = time.time()
+        full_sync = self.index.last_sync is None or \
+            sync_time - self.index.last_full_sync > FULL_RESYNC_SECONDS
+        if full_sync:
+            query = OPEN_CHANGES_QUERY
+            self.index.clear()
+        else:
+            query = '-age:%ds' % (sync_time - self.index.last_sync + AGE_MARGIN)
+
+        for (change_id, status, classification, updated, info) in self.query_changes(query, ['LABELS']):
+            if status in OPEN_STATUSES:
+                self.index.update(change_id, classification, updated, info)
+            else:
+                self.index.remove(change_id)
+
+        self.index.last_sync = sync_time
+        if full_sync:
+            self.index.last_full_sync = sync_time
+
+    def apply_event(self, event):
+        """Updates the index from a Gerrit stream-events event. Returns False if
+           the event can't be applied, and the index needs a sync instead."""
+        change = event.get('change')
+        if not self.incremental or not change or self.index.last_sync is None:
+            return False
+        change_id = '%s~%s~%s' % (urllib.quote(change['project'], safe=''),
+                                  urllib.quote(change['branch'], safe=''), change['id'])
+        updated = time.strftime('%Y-%m-%d %H:%M:%S.000000000',
+                                time.gmtime(event.get('eventCreatedOn', time.time())))
+        with self.index_lock:
+            if event['type'] in CLOSING_EVENTS:
+                self.index.remove(change_id)
+            elif event['type'] == 'patchset-created':
+                # Votes are reset by a new patch set
+                self.index.update(change_id, FOR_REVIEW, updated, self.info_to_store(change))
+            elif event['type'] == 'comment-added':
+                votes = [a for a in event.get('approvals', []) if a.get('type') == 'Code-Review']
+                if votes and int(votes[0]['value']) != 0:
+                    self.index.update(change_id, REVIEWED, updated, self.info_to_store(change))
+                elif votes:
+                    return False  # A vote may have been reset, ask Gerrit
+            else:
+                return False
+        return True
+
+    def split_open_changes(self):
+        (for_review, reviewed) = self.query_many([READY_FOR_REVIEW_QUERY, REVIEWED_QUERY])
+        return ([info for (_, _, _, _, info) in for_review],
+                [info for (_, _, _, _, info) in reviewed])
+
+    def detailed_open_changes(self):
         for_review = []
         reviewed = []
-        all_changes = self.get_response(self.open_changes_url())
-        for change_json in all_changes:
-            detail = self.get_response(self.change_detail_url(change_json['id']))
+        (all_changes, _) = self.get_changes(self.open_changes_url())
+        for (change_id, _, _, updated, info) in all_changes:
+            # Unless the change is updated, its details are taken from the cache
+            detail = self.get_response(self.change_detail_url(change_id), version=updated)
             if self.is_ready_for_review(detail['labels']):
-                for_review.append(self.info_to_store(change_json))
+                for_review.append(info)
             elif self.is_reviewed(detail['labels']):
-                reviewed.append(self.info_to_store(change_json))
+                reviewed.append(info)
         return (for_review, reviewed)
 
 
@@ -57,10 +283,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Get Gerrit status.')
     parser.add_argument('url')
     parser.add_argument('-c', '--change_id', required=False)
+    parser.add_argument('-m', '--mode', default=QUERY_MODE_LABELS,
+                        choices=[QUERY_MODE_LABELS, QUERY_MODE_SPLIT, QUERY_MODE_DETAIL])
     args = parser.parse_args()
 
     changes = [args.change_id] if args.change_id else None
-    g = Gerrit(base_url=args.url)
+    g = Gerrit(base_url=args.url, query_mode=args.mode)
 
     (ready_for_review, reviewed) = g.all_open_changes()
     print
@@ -72,3 +300,4 @@ if __name__ == "__main__":
     for c in reviewed:
         print '', c
     print
+    print 'HTTP:', g.session.stats()
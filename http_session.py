@@ -0,0 +1,263 @@
+import base64
+import contextlib
+import httplib
+import logging
+import socket
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+
+# A hung server must not freeze the monitor thread.
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_PER_HOST = 4
+READ_CHUNK_SIZE = 65536
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+NOT_MODIFIED = 304
+
+
+class HttpError(Exception):
+
+    def __init__(self, url, status, reason, headers=None):
+        Exception.__init__(self, 'HTTP %d %s: %s' % (status, reason, url))
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class DeadlineExceeded(socket.timeout):
+    pass
+
+
+def proxy_authorization(proxy):
+    return 'Basic ' + base64.b64encode('%s:%s' % (urllib.unquote(proxy.username),
+                                                   urllib.unquote(proxy.password or '')))
+
+
+def gunzip(chunks):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+class HttpResponse(object):
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers  # Lower case header names
+        self.body = body
+
+
+class HttpSession(object):
+    """Keep-alive HTTP client, shared by the Gerrit and Jenkins pollers.
+       Connections are pooled per host, and at most max_per_host requests
+       to the same host are in flight at a time. Requests made in a deadline()
+       block give up when it has passed. With auth, a (user, password) tuple,
+       requests use basic authentication. Redirects are followed, and the
+       http_proxy/https_proxy/no_proxy environment variables are honoured,
+       as by urllib2."""
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 max_per_host=DEFAULT_MAX_PER_HOST, auth=None, proxies=None):
+        self.auth = auth
+        self.proxies = urllib.getproxies() if proxies is None else proxies  # Scheme -> proxy URL
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_per_host = max_per_host
+        self.lock = threading.Lock()
+        self.idle = {}   # (scheme, host, port) -> [connection]
+        self.slots = {}  # (scheme, host, port) -> semaphore
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.bytes_received = 0
+        self.local = threading.local()  # The deadline of the calling thread
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        previous = getattr(self.local, 'deadline', None)
+        deadline = time.time() + seconds
+        self.local.deadline = deadline if previous is None else min(previous, deadline)
+        try:
+            yield
+        finally:
+            self.local.deadline = previous
+
+    def remaining(self, timeout):
+        """The timeout, capped by the time left until the deadline, if any."""
+        deadline = getattr(self.local, 'deadline', None)
+        if deadline is None:
+            return timeout
+        left = deadline - time.time()
+        if left <= 0:
+            raise DeadlineExceeded('deadline exceeded')
+        return min(timeout, left)
+
+    def get(self, url, headers=None, consume=None):
+        """Returns an HttpResponse with the (un-gzipped) body, following redirects.
+           Raises HttpError for any other status than 2xx and 304 Not Modified,
+           which is returned like any other response.
+           With consume, the body of a 200 response is never read into memory as a
+           whole: consume(chunks) gets its un-gzipped chunks as they arrive, and
+           returns the body of the HttpResponse. It may be called again, if the
+           request is retried on another connection."""
+        host = urlparse.urlsplit(url).hostname
+        for _ in range(MAX_REDIRECTS + 1):
+            # The credentials are only for the host first asked
+            res = self.get_once(url, headers, consume, urlparse.urlsplit(url).hostname == host)
+            if res.status not in REDIRECT_STATUSES:
+                return res
+            if 'location' not in res.headers:
+                raise HttpError(url, res.status, 'redirect without location', res.headers)
+            logging.debug('redirected from %s to %s', url, res.headers['location'])
+            url = urlparse.urljoin(url, res.headers['location'])
+        raise HttpError(url, res.status, 'too many redirects', res.headers)
+
+    def get_once(self, url, headers, consume, send_auth):
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        proxy = self.proxy_for(key)
+        if proxy and parts.scheme == 'http':
+            path = urlparse.urlunsplit(parts[:4] + ('',))  # A proxy gets the whole URL
+        else:
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+        all_headers = {'Accept-Encoding': 'gzip'}
+        if self.auth and send_auth:
+            all_headers['Authorization'] = 'Basic ' + base64.b64encode('%s:%s' % self.auth)
+        if proxy and proxy.username and parts.scheme == 'http':
+            all_headers['Proxy-Authorization'] = proxy_authorization(proxy)
+        all_headers.update(headers or {})
+
+        self.remaining(self.read_timeout)
+        slot = self.get_slot(key)
+        slot.acquire()
+        try:
+            (res, body) = self.request(key, path, all_headers, consume)
+        finally:
+            slot.release()
+
+        res_headers = dict((k.lower(), v) for (k, v) in res.getheaders())
+        with self.lock:
+            self.requests += 1
+        if not (200 <= res.status < 300 or res.status == NOT_MODIFIED or res.status in REDIRECT_STATUSES):
+            raise HttpError(url, res.status, res.reason, res_headers)
+        return HttpResponse(url, res.status, res_headers, body)
+
+    def proxy_for(self, key):
+        """The split URL of the proxy to use for the (scheme, host, port), or None."""
+        (scheme, host, _) = key
+        if scheme not in self.proxies or urllib.proxy_bypass(host):
+            return None
+        return urlparse.urlsplit(self.proxies[scheme])
+
+    def request(self, key, path, headers, consume=None):
+        conn = self.get_idle_connection(key)
+        if conn:
+            try:
+                result = self.send(key, conn, path, headers, consume)
+                with self.lock:
+                    self.connections_reused += 1
+                return result
+            except socket.timeout:
+                raise  # The server is slow rather than gone, another try would double the wait
+            except (httplib.HTTPException, socket.error) as e:
+                # The server probably closed the kept-alive connection, try a new one
+                logging.debug('reused connection failed: %s', str(e))
+                conn.close()
+        return self.send(key, self.new_connection(key), path, headers, consume)
+
+    def send(self, key, conn, path, headers, consume=None):
+        try:
+            conn.sock.settimeout(self.remaining(self.read_timeout))
+            conn.request('GET', path, headers=headers)
+            res = conn.getresponse()
+            chunks = self.read_chunks(conn, res)
+            if res.getheader('content-encoding') == 'gzip':
+                chunks = gunzip(chunks)
+            if consume and res.status == 200:
+                body = consume(chunks)
+            else:
+                body = ''.join(chunks)
+        except:
+            conn.close()
+            raise
+        if res.will_close or not res.isclosed():  # Not kept alive, or not read to the end
+            conn.close()
+        else:
+            self.put_idle_connection(key, conn)
+        return (res, body)
+
+    def read_chunks(self, conn, res):
+        while True:
+            timeout = self.remaining(self.read_timeout)
+            if conn.sock:  # None once a response closing the connection has begun, the timeout stays
+                conn.sock.settimeout(timeout)
+            chunk = res.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            with self.lock:
+                self.bytes_received += len(chunk)
+            yield chunk
+
+    def new_connection(self, key):
+        (scheme, host, port) = key
+        proxy = self.proxy_for(key)
+        timeout = self.remaining(self.connect_timeout)
+        if proxy and scheme == 'https':
+            conn = httplib.HTTPSConnection(proxy.hostname, proxy.port, timeout=timeout)
+            tunnel_headers = {'Proxy-Authorization': proxy_authorization(proxy)} if proxy.username else None
+            conn.set_tunnel(host, port, tunnel_headers)
+        elif proxy:
+            conn = httplib.HTTPConnection(proxy.hostname, proxy.port, timeout=timeout)
+        elif scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        with self.lock:
+            self.connections_opened += 1
+        return conn
+
+    def get_idle_connection(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def put_idle_connection(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+    def get_slot(self, key):
+        with self.lock:
+            if key not in self.slots:
+                self.slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self.slots[key]
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests,
+                    'connections_opened': self.connections_opened,
+                    'connections_reused': self.connections_reused,
+                    'bytes_received': self.bytes_received}
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for conn in connections:
+                    conn.close()
+            self.idle = {}
@@ -0,0 +1,138 @@
+import Queue
+import SocketServer
+import errno
+import os
+import select
+import sys
+import threading
+
+
+class WakeableEvent(object):
+    """Like threading.Event, but wait() sleeps in select() on a pipe until the
+       timeout or set(), without waking up in between. (In Python 2,
+       threading.Event.wait with a timeout polls every 50 ms.)"""
+
+    def __init__(self):
+        (self.read_fd, self.write_fd) = os.pipe()
+        self.flag = False
+        self.lock = threading.Lock()
+
+    def __del__(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def is_set(self):
+        return self.flag
+
+    def set(self):
+        with self.lock:
+            if not self.flag:
+                self.flag = True
+                os.write(self.write_fd, 'x')
+
+    def clear(self):
+        with self.lock:
+            if self.flag:
+                self.flag = False
+                os.read(self.read_fd, 1)
+
+    def wait(self, timeout=None):
+        """Returns True if set, False after the timeout (None waits for ever)."""
+        if not self.flag:
+            try:
+                if timeout is None:
+                    select.select([self.read_fd], [], [])
+                else:
+                    select.select([self.read_fd], [], [], max(0, timeout))
+            except select.error as e:
+                if e.args[0] != errno.EINTR:  # Interrupted by a signal, the caller waits again
+                    raise
+        return self.flag
+
+
+def event():
+    """A WakeableEvent, or a threading.Event where select() does not take pipes."""
+    if os.name == 'nt':
+        return threading.Event()
+    return WakeableEvent()
+
+
+
+class WorkerPool(object):
+    """A few threads to map a function over items concurrently, like
+       multiprocessing.pool.ThreadPool.map, that sleep in Queue.get() while
+       there is nothing to do. (A ThreadPool checks on its workers every 0.1 s.)"""
+
+    def __init__(self, size, name='worker'):
+        self.tasks = Queue.Queue()
+        for i in range(size):
+            thread = threading.Thread(target=self.work, name='%s-%d' % (name, i))
+            thread.daemon = True
+            thread.start()
+
+    def work(self):
+        while True:
+            (function, index, item, results) = self.tasks.get()
+            try:
+                results.put((index, function(item), None))
+            except Exception:
+                results.put((index, None, sys.exc_info()))
+
+    def map(self, function, items):
+        """Returns [function(item) for item in items], or raises the first error."""
+        items = list(items)
+        results = Queue.Queue()
+        for (index, item) in enumerate(items):
+            self.tasks.put((function, index, item, results))
+        mapped = [None] * len(items)
+        error = None
+        for _ in items:
+            (index, result, exc_info) = results.get()
+            mapped[index] = result
+            error = error or exc_info
+        if error:
+            raise error[0], error[1], error[2]
+        return mapped
+
+
+server_lock = threading.Lock()
+
+
+class WakeableServerMixIn:
+    """For SocketServer servers: serve_forever() sleeps in select() on the socket
+       and a pipe until a request comes or shutdown() is called, rather than
+       waking up every poll_interval (0.5 s)."""
+
+    def shutdown_events(self):
+        with server_lock:
+            if not hasattr(self, 'stop_serving'):
+                self.stop_serving = WakeableEvent()
+                self.stopped_serving = threading.Event()
+        return (self.stop_serving, self.stopped_serving)
+
+    def serve_forever(self, poll_interval=0.5):
+        if os.name == 'nt':
+            return SocketServer.BaseServer.serve_forever(self, poll_interval)
+        (stop_serving, stopped_serving) = self.shutdown_events()
+        stopped_serving.clear()
+        try:
+            while not stop_serving.is_set():
+                try:
+                    (readable, _, _) = select.select([self, stop_serving.read_fd], [], [])
+                except select.error as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    continue
+                if self in readable and not stop_serving.is_set():
+                    self._handle_request_noblock()
+        finally:
+            stop_serving.clear()
+            stopped_serving.set()
+
+    def shutdown(self):
+        """Stops serve_forever, and waits until it has."""
+        if os.name == 'nt':
+            return SocketServer.BaseServer.shutdown(self)
+        (stop_serving, stopped_serving) = self.shutdown_events()
+        stop_serving.set()
+        stopped_serving.wait()
@@ -1,6 +1,15 @@
-from array import *
 import argparse
-from jenkinsapi.jenkins import Jenkins
+import logging
+import time
+import urllib
+
+import http_session
+import idle
+import job_history
+import job_index
+import json_stream
+import metrics
+import response_cache
 
 
 SUCCESS = 'SUCCESS'
@@ -9,19 +18,80 @@ FAILURE = 'FAILURE'
 ABORTED = 'ABORTED'
 NOT_BUILD = 'NOT_BUILD'
 
+# How the job results are fetched:
+#  'bulk' - the results of all jobs in one tree API request
+#  'jobs' - jenkinsapi, a few requests per job (the original behaviour)
+FETCH_MODE_BULK = 'bulk'
+FETCH_MODE_JOBS = 'jobs'
+
+# How many folder levels the bulk request looks into
+FOLDER_DEPTH = 3
+# The build, CI and other test groups are polled right after each other,
+# so they can share one bulk result.
+BULK_MAX_AGE = 10
+
+
+JOB_FIELDS = 'name,lastCompletedBuild[result,number,timestamp],lastBuild[building,timestamp,estimatedDuration]'
+HISTORY_FIELDS = 'name,builds[number,result,timestamp]{0,%d}'
+
+
+def jobs_tree(depth=FOLDER_DEPTH, fields=JOB_FIELDS):
+    """The tree parameter selecting the fields, by default name, latest result
+       and any running build, of all jobs, recursing into folders."""
+    tree = 'jobs[%s]' % fields
+    for _ in range(depth):
+        tree = 'jobs[%s,%s]' % (fields, tree)
+    return tree
+
 
 class JenkinsStatus(object):
 
-    def __init__(self, base_url, build_jobs=None, ci_test_jobs=None, other_test_jobs=None):
+    def __init__(self, base_url, build_jobs=None, ci_test_jobs=None, other_test_jobs=None,
+                 fetch_mode=FETCH_MODE_BULK, workers=0, session=None, cache=None, auth=None,
+                 job_index_interval=job_index.DEFAULT_REFRESH_INTERVAL,
+                 history_size=job_history.DEFAULT_SIZE, failure_rule=None):
         self.jenkins_url = base_url
+        self.auth = auth  # (user, password or API token), or None
         self.server = None
-        self.build_jobs = build_jobs
-        self.ci_test_jobs = ci_test_jobs
-        self.other_test_jobs = other_test_jobs
+        # Job names, or selectors resolved through the job index (see job_index)
+        self.build_selectors = build_jobs or []
+        self.ci_test_selectors = ci_test_jobs or []
+        self.other_test_selectors = other_test_jobs or []
+        self.job_index = job_index.JobIndex(self.get_job_names, self.get_view_job_names,
+                                            job_index_interval)
+        self.fetch_mode = fetch_mode
+        self.bulk_results = None
+        self.bulk_building = {}  # Job name -> expected end time of its running build
+        self.bulk_fetched = 0
+        self.latest = {}  # Job name -> last known status, from polls and pushed notifications
+        self.builds = {}  # Job name -> (number, time) of its latest completed build, when known
+        self.history = job_history.JobHistories(history_size)
+        self.history_seeded = False
+        self.failure_rule = failure_rule  # Optional job_history.FailureRule
+        self.workers = workers  # Max number of concurrent job lookups, 0 is one at a time
+        self.pool = None
+        self.session = session or http_session.HttpSession()
+        self.cache = cache or response_cache.ResponseCache()
+
+    @property
+    def build_jobs(self):
+        return self.job_index.resolve(self.build_selectors)
+
+    @property
+    def ci_test_jobs(self):
+        return self.job_index.resolve(self.ci_test_selectors)
+
+    @property
+    def other_test_jobs(self):
+        return self.job_index.resolve(self.other_test_selectors)
 
     def get_server_instance(self):
         if not self.server:
-            self.server = Jenkins(self.jenkins_url)
+            from jenkinsapi.jenkins import Jenkins  # Slow to import, and only for the 'jobs' mode
+            if self.auth:
+                self.server = Jenkins(self.jenkins_url, username=self.auth[0], password=self.auth[1])
+            else:
+                self.server = Jenkins(self.jenkins_url)
         return self.server
 
     def get_latest_job(self, jenkins_job):
@@ -31,9 +101,82 @@ class JenkinsStatus(object):
         return latest
 
     def get_latest_job_status(self, jenkins_job):
-        job = self.get_latest_job(jenkins_job)
-        status = job.get_status()
-        return status
+        """The latest result of the job, or None if there is no such job."""
+        with metrics.timer('jenkins_get_latest_job_status_seconds'):
+            if self.fetch_mode == FETCH_MODE_BULK:
+                results = self.get_bulk_results()
+                if jenkins_job not in results:
+                    self.job_not_found(jenkins_job)
+                return results.get(jenkins_job)
+            try:
+                job = self.get_latest_job(jenkins_job)
+            except KeyError:  # jenkinsapi's UnknownJob, e.g. a deleted job
+                self.job_not_found(jenkins_job)
+                return None
+            self.builds[jenkins_job] = (job.buildno, None)
+            status = job.get_status()
+            return status
+
+    def job_not_found(self, jenkins_job):
+        logging.warning('no job named %s', jenkins_job)
+        self.job_index.invalidate()  # In case it was matched by a selector
+
+    def jobs_tree_url(self):
+        return '%s/api/json?tree=%s' % (self.jenkins_url, urllib.quote(jobs_tree(), safe=','))
+
+    def get_jobs(self, specific_url, parse_jobs):
+        """parse_jobs(jobs) of the 'jobs' of a JSON API response, where jobs yields
+           one top level job or folder at a time, decoded as the response arrives.
+           Only what parse_jobs returns is kept, also when cached."""
+        with metrics.timer('jenkins_get_response_seconds'):
+            return self.cache.fetch(self.session, specific_url,
+                                    lambda chunks: parse_jobs(json_stream.iter_items(chunks, key='jobs')),
+                                    {'Accept': 'application/json'}, stream=True)
+
+    def get_bulk_results(self):
+        """Returns {job name: latest result} for all jobs, from one request.
+           Jobs in folders are named like 'folder/job'."""
+        if self.bulk_results is None or time.time() - self.bulk_fetched > BULK_MAX_AGE:
+            (results, building, builds) = self.get_jobs(self.jobs_tree_url(), self.parse_results)
+            # Copies, as pushed results update them, but not the cached ones
+            self.bulk_results = dict(results)
+            self.bulk_building = dict(building)
+            self.builds.update(builds)
+            self.bulk_fetched = time.time()
+        return self.bulk_results
+
+    def parse_results(self, jobs_json):
+        """({name: result}, {name: expected end}, {name: (number, time)}) of the jobs."""
+        results = {}
+        building = {}
+        builds = {}
+        self.collect_results(jobs_json, '', results, building, builds)
+        return (results, building, builds)
+
+    def collect_results(self, jobs_json, prefix, results, building, builds):
+        for job_json in jobs_json:
+            name = prefix + job_json['name']
+            if 'jobs' in job_json:  # A folder
+                self.collect_results(job_json['jobs'], name + '/', results, building, builds)
+            if 'lastCompletedBuild' in job_json:
+                latest = job_json['lastCompletedBuild']
+                results[name] = latest['result'] if latest else NOT_BUILD
+                if latest and 'number' in latest:
+                    # Jenkins times are in milliseconds
+                    builds[name] = (latest['number'], latest.get('timestamp', 0) / 1000.0 or None)
+            running = job_json.get('lastBuild')
+            if running and running.get('building'):
+                # Jenkins times are in milliseconds
+                building[name] = (running['timestamp'] + running['estimatedDuration']) / 1000.0
+
+    def get_time_to_finish(self, jobs):
+        """Seconds until the first of the running builds among the jobs is expected
+           to finish (negative if overdue), or None if none of them is building.
+           Only known in the bulk fetch mode."""
+        ends = [self.bulk_building[job] for job in jobs if job in self.bulk_building]
+        if not ends:
+            return None
+        return min(ends) - time.time()
 
     def get_build_status(self):
         return self.get_status(self.build_jobs)
@@ -44,14 +187,41 @@ class JenkinsStatus(object):
     def get_other_tests_status(self):
         return self.get_status(self.other_test_jobs)
 
-    def get_status(self, jobs):
+    def get_all_status(self):
+        """Returns the build, CI test and other tests status tuples, looking up
+           the jobs of all three groups at once."""
+        groups = (self.build_jobs, self.ci_test_jobs, self.other_test_jobs)
+        all_jobs = set()
+        for jobs in groups:
+            all_jobs.update(jobs)
+        statuses = self.get_job_statuses(list(all_jobs))
+        self.update_latest(statuses)
+        return tuple(self.get_status(jobs, statuses) for jobs in groups)
+
+    def get_job_statuses(self, jobs):
+        """Returns {job: latest status}. With workers configured, the jobs are
+           looked up concurrently, at most that many at a time."""
+        if self.workers and self.fetch_mode == FETCH_MODE_JOBS and len(jobs) > 1:
+            self.get_server_instance()  # Once, before the workers need it
+            return dict(zip(jobs, self.get_pool().map(self.get_latest_job_status, jobs)))
+        return dict((job, self.get_latest_job_status(job)) for job in jobs)
+
+    def get_pool(self):
+        if not self.pool:
+            self.pool = idle.WorkerPool(self.workers, 'jenkins')
+        return self.pool
+
+    def get_status(self, jobs, statuses=None):
+        if statuses is None:
+            statuses = self.get_job_statuses(jobs)
+            self.update_latest(statuses)
         failures = []
         successes = []
         unstable = []
         aborted = []
         not_run = []
         for job in jobs:
-            status = self.get_latest_job_status(job)
+            status = statuses.get(job)
             if status == SUCCESS:
                 successes.append(job)
             elif status == UNSTABLE:
@@ -62,21 +232,107 @@ class JenkinsStatus(object):
                 aborted.append(job)
             elif status == NOT_BUILD:
                 not_run.append(job)
+        if self.failure_rule:
+            unstable += [job for job in failures if not self.failure_rule.is_failing(self.history.get(job))]
+            failures = [job for job in failures if self.failure_rule.is_failing(self.history.get(job))]
         return (successes, unstable, failures, aborted, not_run)
 
+    def update_latest(self, statuses):
+        if self.failure_rule and not self.history_seeded:
+            self.seed_history()
+        self.latest.update(statuses)
+        for (job, status) in statuses.items():
+            if status is not None:
+                (number, timestamp) = self.builds.get(job, (None, None))
+                self.history.record(job, status, number, timestamp)
+
+    def history_tree_url(self):
+        tree = jobs_tree(fields=HISTORY_FIELDS % self.history.size)
+        return '%s/api/json?tree=%s' % (self.jenkins_url, urllib.quote(tree, safe=',{}'))
+
+    def seed_history(self):
+        """Fills the job histories with the latest builds, in one request. Only in
+           the bulk fetch mode; in the jobs mode the histories fill up as builds
+           are polled."""
+        self.history_seeded = True
+        if self.fetch_mode != FETCH_MODE_BULK:
+            return
+        try:
+            for (name, builds) in self.get_jobs(self.history_tree_url(), self.parse_history):
+                for (result, number, timestamp) in builds:
+                    self.history.record(name, result, number, timestamp)
+        except Exception as e:
+            logging.warning('could not get the build history:\n%s', str(e))
+
+    def parse_history(self, jobs_json):
+        """[(name, [(result, number, time)], oldest first)] of the jobs."""
+        job_builds = []
+        self.collect_history(jobs_json, '', job_builds)
+        return job_builds
+
+    def collect_history(self, jobs_json, prefix, job_builds):
+        for job_json in jobs_json:
+            name = prefix + job_json['name']
+            if 'jobs' in job_json:  # A folder
+                self.collect_history(job_json['jobs'], name + '/', job_builds)
+            # Jenkins times are in milliseconds
+            builds = [(build['result'], build['number'], build['timestamp'] / 1000.0)
+                      for build in reversed(job_json.get('builds') or [])  # Oldest first
+                      if build.get('result')]  # Not still running
+            if builds:
+                job_builds.append((name, builds))
+
+    def get_history(self, jobs):
+        """{job: summary of its history} of the jobs, see JobHistory.summary."""
+        return self.history.summaries(jobs)
+
+    def record_result(self, jenkins_job, status, number=None):
+        """Records a result pushed from Jenkins, e.g. by the notification plugin.
+           A result of an older build than the latest one known is ignored."""
+        if number is not None:
+            known = self.builds.get(jenkins_job)
+            if known and number < known[0]:
+                return
+            self.builds[jenkins_job] = (number, time.time())
+        self.latest[jenkins_job] = status
+        self.history.record(jenkins_job, status, number)
+        if self.bulk_results is not None:
+            self.bulk_results[jenkins_job] = status
+        self.bulk_building.pop(jenkins_job, None)
+
+    def get_known_status(self, jobs):
+        """Like get_status, but from the last known statuses, without any request."""
+        return self.get_status(jobs, self.latest)
+
+    def get_job_names(self):
+        if self.fetch_mode == FETCH_MODE_BULK:
+            return sorted(self.get_bulk_results())
+        return self.get_server_instance().keys()  # Without looking up each job
+
+    def view_url(self, view):
+        return '%s/view/%s/api/json?tree=jobs[name]' % (self.jenkins_url, urllib.quote(view))
+
+    def get_view_job_names(self, view):
+        return self.get_jobs(self.view_url(view), lambda jobs_json: [job['name'] for job in jobs_json])
+
     def get_all_jobs(self):
+        if self.fetch_mode == FETCH_MODE_BULK:
+            return [(name, None) for name in sorted(self.get_bulk_results())]
         return self.get_server_instance().get_jobs()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Get Jenkins status.')
     parser.add_argument('url')
-    parser.add_argument('-j', '--job', nargs='*', required=False)
+    parser.add_argument('-j', '--job', nargs='*', required=False,
+                        help='Job names or selectors, e.g. "release-*", "re:release-\\d+" or "view:Nightly".')
+    parser.add_argument('-m', '--mode', default=FETCH_MODE_BULK,
+                        choices=[FETCH_MODE_BULK, FETCH_MODE_JOBS])
     args = parser.parse_args()
 
     jobs = args.job if args.job else None
-    j = JenkinsStatus(base_url=args.url, build_jobs=jobs)
+    j = JenkinsStatus(base_url=args.url, build_jobs=jobs, fetch_mode=args.mode)
     if jobs:
-        (s, u, f, a, n) = j.get_status(jobs)
+        (s, u, f, a, n) = j.get_status(j.build_jobs)
         print '  Success:'
         print '\n'.join(s)
         print '  Unstable:'
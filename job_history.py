@@ -0,0 +1,125 @@
+import array
+import threading
+import time
+
+DEFAULT_SIZE = 20
+
+# Results are stored as small integers, unknown ones as OTHER
+RESULTS = ('SUCCESS', 'UNSTABLE', 'FAILURE', 'ABORTED', 'NOT_BUILD')
+OTHER = len(RESULTS)
+FAILURE_CODE = RESULTS.index('FAILURE')
+
+
+def result_code(result):
+    return RESULTS.index(result) if result in RESULTS else OTHER
+
+
+def result_name(code):
+    return RESULTS[code] if code < OTHER else None
+
+
+class JobHistory(object):
+    """The results, build numbers and times of the latest size builds of a job,
+       in ring buffers of fixed size."""
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.results = array.array('b', [OTHER] * size)
+        self.numbers = array.array('l', [0] * size)
+        self.times = array.array('d', [0.0] * size)
+        self.count = 0  # Builds recorded so far; the latest is at (count - 1) % size
+
+    def latest_index(self):
+        return (self.count - 1) % self.size
+
+    def record(self, result, number=None, timestamp=None):
+        """Records a build, unless it is the latest one already, or older. Without
+           a build number, only a change of result counts as a new build."""
+        code = result_code(result)
+        if self.count:
+            i = self.latest_index()
+            if number is not None and number <= self.numbers[i]:
+                return False
+            if number is None and code == self.results[i]:
+                return False
+        i = self.count % self.size
+        self.results[i] = code
+        self.numbers[i] = number or 0
+        self.times[i] = timestamp or time.time()
+        self.count += 1
+        return True
+
+    def latest(self, n=None):
+        """The indexes of the latest n builds (all recorded ones by default), oldest first."""
+        n = min(n or self.size, self.count, self.size)
+        return [(self.count - n + k) % self.size for k in range(n)]
+
+    def failures(self, n):
+        """How many of the latest n builds failed."""
+        return sum(1 for i in self.latest(n) if self.results[i] == FAILURE_CODE)
+
+    def flakiness(self):
+        """The part of the recorded builds with another result than the build
+           before, 0.0 for a stable job and 1.0 for one flipping every build."""
+        indexes = self.latest()
+        if len(indexes) < 2:
+            return 0.0
+        flips = sum(1 for (a, b) in zip(indexes, indexes[1:]) if self.results[a] != self.results[b])
+        return flips / float(len(indexes) - 1)
+
+    def time_in_state(self, now=None):
+        """Seconds since the first of the latest builds with the current result."""
+        indexes = self.latest()
+        if not indexes:
+            return None
+        current = self.results[indexes[-1]]
+        since = self.times[indexes[-1]]
+        for i in reversed(indexes):
+            if self.results[i] != current:
+                break
+            since = self.times[i]
+        return (now or time.time()) - since
+
+    def summary(self):
+        indexes = self.latest()
+        return {'results': [result_name(self.results[i]) for i in indexes],
+                'builds': [self.numbers[i] for i in indexes],
+                'flakiness': round(self.flakiness(), 3),
+                'seconds_in_state': self.time_in_state()}
+
+
+class FailureRule(object):
+    """A failed job counts as failing (red) only if at least failures of its
+       latest of_last builds failed; otherwise it counts as unstable."""
+
+    def __init__(self, failures, of_last):
+        self.failures = failures
+        self.of_last = of_last
+
+    def is_failing(self, history):
+        if history is None or history.count < self.failures:
+            return True  # Too few builds to go on, trust the latest result
+        return history.failures(self.of_last) >= self.failures
+
+
+class JobHistories(object):
+    """A JobHistory per job."""
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.histories = {}
+        self.lock = threading.Lock()
+
+    def record(self, job, result, number=None, timestamp=None):
+        with self.lock:
+            history = self.histories.get(job)
+            if history is None:
+                history = self.histories[job] = JobHistory(self.size)
+            return history.record(result, number, timestamp)
+
+    def get(self, job):
+        return self.histories.get(job)
+
+    def summaries(self, jobs):
+        with self.lock:
+            return dict((job, self.histories[job].summary()) for job in jobs if job in self.histories)
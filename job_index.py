@@ -0,0 +1,98 @@
+import fnmatch
+import logging
+import re
+import threading
+import time
+
+DEFAULT_REFRESH_INTERVAL = 900
+MIN_REFRESH_INTERVAL = 60  # Even when asked to, e.g. after a job was not found
+
+# Job selectors, besides exact job names:
+#  'release-*'      - a glob pattern
+#  're:release-\d+' - a regular expression, matched from the start of the name
+#  'view:Nightly'   - the jobs of a Jenkins view
+REGEX_PREFIX = 're:'
+VIEW_PREFIX = 'view:'
+GLOB_CHARACTERS = '*?['  # None of them is allowed in a Jenkins job name
+
+
+def is_pattern(selector):
+    return selector.startswith(REGEX_PREFIX) or selector.startswith(VIEW_PREFIX) or \
+        any(c in selector for c in GLOB_CHARACTERS)
+
+
+class JobIndex(object):
+    """The names of all jobs of a Jenkins, and of the jobs in its views, for
+       resolving job selectors. They are listed again every refresh_interval
+       seconds, or after invalidate(), rather than on every poll. Lists of exact
+       job names are used as they are, without any listing."""
+
+    def __init__(self, list_jobs, list_view_jobs, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.list_jobs = list_jobs
+        self.list_view_jobs = list_view_jobs
+        self.refresh_interval = refresh_interval
+        self.names = None
+        self.views = {}     # View name -> job names
+        self.resolved = {}  # Selectors -> job names
+        self.refreshed = 0
+        self.invalidated = False
+        self.lock = threading.RLock()
+
+    def invalidate(self):
+        with self.lock:
+            self.invalidated = True
+
+    def refresh_if_due(self):
+        age = time.time() - self.refreshed
+        if self.names is not None and age < self.refresh_interval and \
+                not (self.invalidated and age >= MIN_REFRESH_INTERVAL):
+            return
+        try:
+            names = self.list_jobs()
+        except Exception as e:
+            if self.names is None:
+                raise
+            logging.warning('could not list the jobs, using the old list:\n%s', str(e))
+            self.refreshed = time.time()
+            return
+        logging.debug('listed %d jobs', len(names))
+        self.names = names
+        self.views = {}
+        self.resolved = {}
+        self.refreshed = time.time()
+        self.invalidated = False
+
+    def resolve(self, selectors):
+        """The names of the jobs matching any of the selectors, in selector order."""
+        if not any(is_pattern(selector) for selector in selectors):
+            return selectors
+        with self.lock:
+            self.refresh_if_due()
+            key = tuple(selectors)
+            if key not in self.resolved:
+                self.resolved[key] = self.match(selectors)
+            return self.resolved[key]
+
+    def match(self, selectors):
+        jobs = []
+        seen = set()
+        for selector in selectors:
+            if selector.startswith(VIEW_PREFIX):
+                matches = self.view_jobs(selector[len(VIEW_PREFIX):])
+            elif selector.startswith(REGEX_PREFIX):
+                regex = re.compile(selector[len(REGEX_PREFIX):])
+                matches = [name for name in self.names if regex.match(name)]
+            elif is_pattern(selector):
+                matches = fnmatch.filter(self.names, selector)
+            else:
+                matches = [selector]
+            for name in matches:
+                if name not in seen:
+                    seen.add(name)
+                    jobs.append(name)
+        return jobs
+
+    def view_jobs(self, view):
+        if view not in self.views:
+            self.views[view] = self.list_view_jobs(view)
+        return self.views[view]
@@ -0,0 +1,136 @@
+"""Decodes the items of big JSON arrays one at a time, as the chunks of a response
+arrive, so that only the item being decoded is held in memory, never the whole
+body or the whole array."""
+import json
+
+# Gerrit starts its JSON with this, against cross site script inclusion, see
+# https://gerrit-review.googlesource.com/Documentation/rest-api.html#output
+XSSI_PREFIX = ")]}'"
+WHITESPACE = ' \t\n\r'
+NUMBER_ENDS = WHITESPACE + ',]}'  # What may follow a number
+
+DECODER = json.JSONDecoder()
+
+
+def skip(body, pos, prefix=None):
+    """The position of the next value in body from pos, past whitespace and the
+       prefix, if it is there."""
+    while pos < len(body) and body[pos] in WHITESPACE:
+        pos += 1
+    if prefix and body.startswith(prefix, pos):
+        return skip(body, pos + len(prefix))
+    return pos
+
+
+def loads(body, prefix=None):
+    """json.loads of the body, skipping the prefix, if there, without copying the body."""
+    return DECODER.raw_decode(body, skip(body, 0, prefix))[0]
+
+
+class StreamReader(object):
+    """A JSON value read from an iterator of chunks, e.g. from HttpSession.get
+       with consume. Only the part not decoded yet is buffered."""
+
+    def __init__(self, chunks, prefix=None):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+        self.skip_whitespace()
+        if prefix and self.ensure(len(prefix)) and self.buffer.startswith(prefix, self.pos):
+            self.pos += len(prefix)
+
+    def fill(self):
+        """Reads another chunk, dropping what has been decoded. Returns False at the end."""
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def ensure(self, length):
+        """Reads until length bytes are buffered, if there are that many."""
+        while len(self.buffer) - self.pos < length:
+            if not self.fill():
+                return False
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            self.pos = skip(self.buffer, self.pos)
+            if self.pos < len(self.buffer) or not self.fill():
+                return
+
+    def peek(self):
+        """The next character that is not whitespace, '' at the end."""
+        self.skip_whitespace()
+        return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError('expected %r in JSON, found %r' % (character, self.peek()))
+        self.pos += 1
+
+    def decode(self):
+        """Decodes the next value."""
+        self.skip_whitespace()
+        ended = False
+        while True:
+            try:
+                (value, end) = DECODER.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if ended:
+                    raise
+                # Incomplete, read at least as much again before retrying, so that a
+                # big value is not decoded over and over
+                ended = not self.ensure(2 * (len(self.buffer) - self.pos) + 1)
+                continue
+            # Containers, strings and literals end with their last character, but a
+            # number cut short by the end of a chunk (like 3. of 3.5e10) decodes too
+            if isinstance(value, (int, long, float)) and not isinstance(value, bool) and \
+                    (end == len(self.buffer) or self.buffer[end] not in NUMBER_ENDS) and \
+                    not ended and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self, decode_item=None):
+        """Yields the items of the array at the current position, each decoded
+           by decode_item(), by default decode(). decode_item can read a nested
+           array with items(), e.g. for a list of lists."""
+        decode_item = decode_item or self.decode
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield decode_item()
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+
+    def member(self, key):
+        """Moves to the value of key in the object at the current position,
+           skipping the members before it. Returns False if it is not there."""
+        self.expect('{')
+        while self.peek() not in ('}', ''):
+            name = self.decode()
+            self.expect(':')
+            if name == key:
+                return True
+            self.decode()
+            if self.peek() == ',':
+                self.pos += 1
+        return False
+
+
+def iter_items(chunks, key=None, prefix=None):
+    """Yields the items of the JSON array in the chunks, one at a time. With key,
+       the array is the value of key in an object, e.g. 'jobs' of a Jenkins API
+       response; nothing is yielded if it is not there."""
+    reader = StreamReader(chunks, prefix)
+    if key is not None and not reader.member(key):
+        return
+    for item in reader.items():
+        yield item
@@ -0,0 +1,204 @@
+"""Timings and counters of the monitor's hot paths, served as text on /metrics
+and optionally logged now and then. Everything is a no-op until enable() is
+called, so leaving the instrumentation in costs next to nothing."""
+import BaseHTTPServer
+import SocketServer
+import logging
+import threading
+import time
+
+import idle
+
+DEFAULT_PORT = 8767
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+enabled = False
+lock = threading.Lock()
+histograms = {}   # (name, label) -> Histogram
+counters = {}     # (name, label) -> count
+last_marks = {}   # (name, label) -> time
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for (i, bound) in enumerate(BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class Timer(object):
+
+    def __init__(self, name, label):
+        self.name = name
+        self.label = label
+        self.t0 = None
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.name, time.time() - self.t0, self.label)
+        if exc_type is not None:
+            count(self.name.replace('_seconds', '') + '_errors', label=self.label)
+        return False
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_TIMER = NullTimer()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def timer(name, label=None):
+    """Times a with block into the histogram name. Exceptions are also
+       counted, as name without '_seconds' plus '_errors'."""
+    if not enabled:
+        return NULL_TIMER
+    return Timer(name, label)
+
+
+def observe(name, value, label=None):
+    if not enabled:
+        return
+    with lock:
+        histogram = histograms.get((name, label))
+        if histogram is None:
+            histogram = histograms[(name, label)] = Histogram()
+        histogram.observe(value)
+
+
+def count(name, n=1, label=None):
+    if not enabled:
+        return
+    with lock:
+        counters[(name, label)] = counters.get((name, label), 0) + n
+
+
+def mark(name, label=None):
+    """Records that something happened now, reported as seconds since."""
+    if not enabled:
+        return
+    with lock:
+        last_marks[(name, label)] = time.time()
+
+
+def metric_name(name, label, suffix='', extra=None):
+    labels = []
+    if label is not None:
+        labels.append('name="%s"' % label)
+    if extra:
+        labels.append(extra)
+    return '%s%s%s' % (name, suffix, '{%s}' % ','.join(labels) if labels else '')
+
+
+def render():
+    """All metrics in the Prometheus text format."""
+    lines = []
+    now = time.time()
+    with lock:
+        for ((name, label), h) in sorted(histograms.items()):
+            for (bound, bucket_count) in zip(BUCKETS, h.bucket_counts):
+                lines.append('%s %d' % (metric_name(name, label, '_bucket', 'le="%g"' % bound), bucket_count))
+            lines.append('%s %d' % (metric_name(name, label, '_bucket', 'le="+Inf"'), h.count))
+            lines.append('%s %d' % (metric_name(name, label, '_count'), h.count))
+            lines.append('%s %f' % (metric_name(name, label, '_sum'), h.sum))
+            lines.append('%s %f' % (metric_name(name, label, '_max'), h.max))
+        for ((name, label), n) in sorted(counters.items()):
+            lines.append('%s %d' % (metric_name(name, label), n))
+        for ((name, label), t) in sorted(last_marks.items()):
+            lines.append('%s %f' % (metric_name(name, label, '_age_seconds'), now - t))
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """A one line summary: mean/max of each histogram, counters and ages."""
+    parts = []
+    now = time.time()
+    with lock:
+        for ((name, label), h) in sorted(histograms.items()):
+            parts.append('%s: %d, mean %.3f s, max %.3f s' % (metric_name(name, label), h.count,
+                                                               h.sum / h.count, h.max))
+        for ((name, label), n) in sorted(counters.items()):
+            parts.append('%s: %d' % (metric_name(name, label), n))
+        for ((name, label), t) in sorted(last_marks.items()):
+            parts.append('%s: %.0f s ago' % (metric_name(name, label), now - t))
+    return '; '.join(parts)
+
+
+class MetricsServer(idle.WakeableServerMixIn, SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=DEFAULT_PORT, host='localhost'):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), MetricsHandler)
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsReporter(object):
+    """Serves /metrics and/or logs a summary every log_interval seconds."""
+
+    def __init__(self, port=None, log_interval=None):
+        self.server = MetricsServer(port) if port else None
+        self.log_interval = log_interval
+        self.stopped = idle.event()
+        self.threads = []
+
+    def start(self):
+        enable()
+        if self.server:
+            self.start_thread(self.server.serve_forever)
+            logging.info('serving metrics on port %d', self.server.server_address[1])
+        if self.log_interval:
+            self.start_thread(self.log_summaries)
+
+    def start_thread(self, target):
+        thread = threading.Thread(target=target, name='metrics')
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def log_summaries(self):
+        while not self.stopped.wait(self.log_interval):
+            logging.info('metrics: %s', summary())
+
+    def stop(self):
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
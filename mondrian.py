@@ -3,25 +3,39 @@ import logging
 import time
 import threading
 import argparse
-from wx.lib.pubsub import pub as Publisher
+import functools
 import json
-import datetime
 
 import jenkins_status
 import gerrit
-import monitor_view
-import pymouse
+import federation
+import http_session
+import idle
+import job_history
+import job_index
+import metrics
+import response_cache
+import monitor_status
+import panel_state
+import poll_engine
+import poll_schedule
+import push_receiver
+import resilience
+import snapshot
+import state_server
+import work_calendar
 
 
 SECONDS_BETWEEN_POLLS = 120
-MICRONAP = 2
 
 MOUSE_DIFF = 1
+KEEP_ALIVE_INTERVAL = 240  # Seconds between mouse nudges, well within a screen saver timeout
 
-EARLIEST_HOUR = 6
-LATEST_HOUR = 17
-ISO_MONDAY = 1
-ISO_FRIDAY = 5
+# Poll intervals of the 'tasks' poll engine, unless configured
+DEFAULT_SCHEDULE = {'build': 15,
+                    'ci_test': 60,
+                    'other_tests': 120,
+                    'gerrit': 180}
 
 
 class MonitorThread(threading.Thread):
@@ -30,118 +44,331 @@ class MonitorThread(threading.Thread):
 
     def __init__(self, jenkins_instance, gerrit_instance,
                  gerrit_for_review_limits, gerrit_reviewed_limits,
-                 powersave=False, keep_alive=False):
+                 powersave=False, keep_alive=False, schedule=None,
+                 publish=monitor_status.send_to_view, on_polled=None, guards=None,
+                 working_hours=None, keep_alive_interval=KEEP_ALIVE_INTERVAL):
         threading.Thread.__init__(self)
         self.running_monitor_thread = False
         self.jenkins = jenkins_instance
         self.gerrit = gerrit_instance
-        self.gerrit_for_review_limits = gerrit_for_review_limits
-        self.gerrit_reviewed_limits = gerrit_reviewed_limits
+        self.poster = monitor_status.StatusPoster(gerrit_for_review_limits, gerrit_reviewed_limits,
+                                                  publish)
         self.powersave = powersave
         self.keep_alive = keep_alive
+        self.schedule = schedule or poll_schedule.AdaptiveSchedule(SECONDS_BETWEEN_POLLS)
+        self.on_polled = on_polled  # Optional, called after each complete poll
+        self.guards = guards or create_guards(jenkins_instance, gerrit_instance)
+        self.errors = []
+        self.working_hours = working_hours or work_calendar.WorkingHours()
+        self.keep_alive_interval = keep_alive_interval
+        self.mouse = None
+        self.mouse_diff = MOUSE_DIFF
+        self.nudged = 0
+        self.wakeup = idle.event()
         self.start()
 
     def run(self):
         self.running_monitor_thread = True
         try:
-            mouse = pymouse.PyMouse()
+            if self.keep_alive:
+                import pymouse
+                self.mouse = pymouse.PyMouse()
             while self.running_monitor_thread:
-                if self.powersave and not self.working_hours():
-                    self.sleep_with_one_eye_open(SECONDS_BETWEEN_POLLS)
+                if self.powersave and not self.working_hours.is_working():
+                    # Let the screen saver in, and sleep until the working hours start
+                    self.sleep_with_one_eye_open(self.working_hours.seconds_until_change())
                     continue
 
-                if self.keep_alive:
-                    (initial_x, initial_y) = mouse.position()
-                    new_x = initial_x + MOUSE_DIFF
-                    new_y = initial_y + MOUSE_DIFF
-                    mouse.move(new_x, new_y)
-
-                (success, unstable, fail, _, _) = self.jenkins.get_build_status()
-                self.post_jenkins_status(monitor_view.UPDATE_BUILD_PUBSUB, success, unstable, fail)
-                if not self.running_monitor_thread:
-                    break
-
-                (success, unstable, fail, _, _) = self.jenkins.get_ci_test_status()
-                self.post_jenkins_status(monitor_view.UPDATE_CI_TEST_PUBSUB, success, unstable, fail)
-                if not self.running_monitor_thread:
-                    break
-
-                (success, unstable, fail, _, _) = self.jenkins.get_other_tests_status()
-                self.post_jenkins_status(monitor_view.UPDATE_OTHER_TESTS_PUBSUB, success, unstable, fail)
-                if not self.running_monitor_thread:
+                state = self.poll()
+                if state is None:
                     break
-
-                (gerrit_for_review, gerrit_reviewed) = self.gerrit.all_open_changes()
-
-                rfr_status = len(gerrit_for_review)
-                self.post_ready_for_review_status(rfr_status)
-                reviewed_status = len(gerrit_reviewed)
-                self.post_reviewed_status(reviewed_status)
-
-                # Move mouse back a little
-                if self.keep_alive:
-                    (initial_x, initial_y) = mouse.position()
-                    new_x = initial_x - MOUSE_DIFF
-                    new_y = initial_y - MOUSE_DIFF
-                    mouse.move(new_x, new_y)
-
-                self.sleep_with_one_eye_open(SECONDS_BETWEEN_POLLS)
+                if self.errors:
+                    # The placeholders of a failed source are no change to poll sooner
+                    # for, and a busy server asks to be polled less often
+                    logging.warning('%d of %d sources failed, backing off', len(self.errors), len(self.guards))
+                    self.schedule.failed(busiest(self.errors))
+                else:
+                    self.schedule.polled(state, self.time_to_finish())
+                if len(self.errors) < len(self.guards) and self.on_polled:
+                    self.on_polled()
+
+                logging.debug('http: %s, cache: %s',
+                              [source.session.stats() for source in
+                               federation.sources(self.jenkins) + federation.sources(self.gerrit)],
+                              self.gerrit.cache.stats())
+                logging.debug('next poll in %d s', self.schedule.interval)
+                self.sleep_with_one_eye_open(self.schedule.interval)
 
         except Exception as e:
             logging.error('monitor thread exception:\n%s', str(e))
             time.sleep(1)  # Just to give the view time to subscribe
-            Publisher.sendMessage(monitor_view.SHUTDOWN_PUBSUB)
+            self.poster.publish(monitor_status.SHUTDOWN_PUBSUB)
 
         logging.debug('done monitoring')
 
+    def poll(self):
+        """Polls all servers once, each on its own, so that a failing one does not
+           stop the others. Returns the published statuses (None for the panels of
+           a failed source), or None if stopped on the way. The errors of the failed
+           sources are left in self.errors."""
+        self.errors = []
+        jenkins_statuses = self.poll_source('jenkins', self.fetch_jenkins, post_jenkins,
+                                            monitor_status.JENKINS_TOPICS)
+        if not self.running_monitor_thread:
+            return None
+        gerrit_statuses = self.poll_source('gerrit', self.fetch_gerrit, post_gerrit,
+                                           monitor_status.GERRIT_TOPICS)
+        return jenkins_statuses + gerrit_statuses
+
+    def time_to_finish(self):
+        """When the first running build is expected to finish, if known."""
+        try:
+            all_jobs = self.jenkins.build_jobs + self.jenkins.ci_test_jobs + self.jenkins.other_test_jobs
+            return self.jenkins.get_time_to_finish(all_jobs)
+        except Exception as e:  # E.g. the job selectors could not be resolved
+            logging.debug('no time to finish: %s', str(e))
+            return None
+
+    def poll_source(self, name, fetch, post, topics):
+        try:
+            return poll_guarded(self.guards[name], fetch, post, self.poster, topics)
+        except Exception as e:
+            logging.warning('%s poll failed:\n%s', name, str(e))
+            self.errors.append(e)
+            return (None,) * len(topics)
+
+    def fetch_jenkins(self):
+        """The statuses of the three job groups, None for those not fetched
+           because the thread was stopped on the way."""
+        if self.jenkins.workers:
+            with metrics.timer('poll_seconds', 'jenkins'):
+                return self.jenkins.get_all_status()
+        statuses = [None, None, None]
+        for (i, name, get_status) in ((0, 'build', self.jenkins.get_build_status),
+                                      (1, 'ci_test', self.jenkins.get_ci_test_status),
+                                      (2, 'other_tests', self.jenkins.get_other_tests_status)):
+            if not self.running_monitor_thread:
+                break
+            with metrics.timer('poll_seconds', name):
+                statuses[i] = get_status()
+        return statuses
+
+    def fetch_gerrit(self):
+        with metrics.timer('poll_seconds', 'gerrit'):
+            return self.gerrit.all_open_changes()
+
     def sleep_with_one_eye_open(self, seconds_to_sleep):
-        t0 = time.time()
-        t = t0
-        while self.running_monitor_thread and ((t - t0) < seconds_to_sleep):
-            time.sleep(MICRONAP)
-            t = time.time()
-
-    def working_hours(self):
-        today = datetime.datetime.now()
-        workinghour = (today.hour >= EARLIEST_HOUR) and (today.hour <= LATEST_HOUR)
-        workingday = (today.isoweekday() >= ISO_MONDAY) and (today.isoweekday() <= ISO_FRIDAY)
-        return workingday and workinghour
-
-    def post_jenkins_status(self, job_pubsub, successes, unstable, failures):
-        if len(failures) != 0:
-            view_status = monitor_view.STATUS_BAD
-        elif len(unstable) != 0:
-            view_status = monitor_view.STATUS_ALMOST_BAD
-        elif len(successes) > 0:
-            view_status = monitor_view.STATUS_GOOD
-        else:
-            view_status = monitor_view.STATUS_ALMOST_GOOD
-        Publisher.sendMessage(job_pubsub, status=view_status)
-
-    def post_ready_for_review_status(self, status):
-        if status == self.gerrit_for_review_limits['good']:
-            view_status = monitor_view.STATUS_GOOD
-        elif status < self.gerrit_for_review_limits['almost_good']:
-            view_status = monitor_view.STATUS_ALMOST_GOOD
-        elif status < self.gerrit_for_review_limits['almost_bad']:
-            view_status = monitor_view.STATUS_ALMOST_BAD
-        else:
-            view_status = monitor_view.STATUS_BAD
-        Publisher.sendMessage(monitor_view.UPDATE_GERRIT_FOR_REVIEW_PUBSUB, status=view_status)
-
-    def post_reviewed_status(self, status):
-        if status == self.gerrit_reviewed_limits['good']:
-            view_status = monitor_view.STATUS_GOOD
-        elif status < self.gerrit_reviewed_limits['almost_good']:
-            view_status = monitor_view.STATUS_ALMOST_GOOD
-        elif status < self.gerrit_reviewed_limits['almost_bad']:
-            view_status = monitor_view.STATUS_ALMOST_BAD
+        """Sleeps until the time is up, or the thread is woken or stopped, waking up
+           only to keep the screen alive, when it should (None sleeps until woken)."""
+        if not (self.keep_alive and self.mouse) or \
+                (self.powersave and not self.working_hours.is_working()):
+            self.wakeup.wait(seconds_to_sleep)
         else:
-            view_status = monitor_view.STATUS_BAD
-        Publisher.sendMessage(monitor_view.UPDATE_GERRIT_REVIEWED_PUBSUB, status=view_status)
+            wake_up = time.time() + seconds_to_sleep
+            while not self.wakeup.is_set() and time.time() < wake_up:
+                if time.time() - self.nudged >= self.keep_alive_interval:
+                    self.keep_screen_alive()
+                self.wakeup.wait(min(wake_up, self.nudged + self.keep_alive_interval) - time.time())
+        self.wakeup.clear()
+
+    def keep_screen_alive(self):
+        nudge_mouse(self.mouse, self.mouse_diff)
+        self.mouse_diff = -self.mouse_diff  # Back and forth
+        self.nudged = time.time()
+
+    def wake(self):
+        """Has all servers polled right away, e.g. after an event the Gerrit
+           index could not take in."""
+        self.wakeup.set()
 
     def stop(self):
         self.running_monitor_thread = False
+        self.wakeup.set()
+
+
+class IdleWatcher(threading.Thread):
+    """Publishes IDLE_PUBSUB, idle=True outside the working hours and idle=False
+       within them, at start and whenever it changes, sleeping in between."""
+
+    def __init__(self, working_hours, publish=monitor_status.send_to_view):
+        threading.Thread.__init__(self, name='idle')
+        self.daemon = True
+        self.working_hours = working_hours
+        self.publish = publish
+        self.idle = None  # As last published
+        self.stopped = idle.event()
+
+    def run(self):
+        self.stopped.wait(poll_engine.START_DELAY)  # Just to give the view time to subscribe
+        while not self.stopped.is_set():
+            is_idle = not self.working_hours.is_working()
+            if is_idle != self.idle:  # Not e.g. on waking up a moment early
+                logging.info('idle until the working hours' if is_idle else 'working hours')
+                self.publish(monitor_status.IDLE_PUBSUB, idle=is_idle)
+                self.idle = is_idle
+            self.stopped.wait(self.working_hours.seconds_until_change())
+
+    def stop(self):
+        self.stopped.set()
+
+
+def post_jenkins(poster, statuses):
+    """Posts the statuses of the three job groups, skipping those that are None."""
+    return tuple(poster.post_jenkins_status(topic, *status[:3]) if status else None
+                 for (topic, status) in zip(monitor_status.JENKINS_TOPICS, statuses))
+
+
+def post_gerrit(poster, changes):
+    (gerrit_for_review, gerrit_reviewed) = changes
+    rfr_status = poster.post_ready_for_review_status(len(gerrit_for_review))
+    reviewed_status = poster.post_reviewed_status(len(gerrit_reviewed))
+    return (rfr_status, reviewed_status)
+
+
+def busiest(errors):
+    """The error of a server asking to be left alone for a while, if any, as its
+       Retry-After is to be honoured, or else the last one."""
+    for error in errors:
+        if isinstance(error, http_session.HttpError) and error.status in poll_schedule.BUSY_STATUSES:
+            return error
+    return errors[-1]
+
+
+def nudge_mouse(mouse, diff):
+    (initial_x, initial_y) = mouse.position()
+    mouse.move(initial_x + diff, initial_y + diff)
+
+
+def create_guard(name, session, resilience_data=None):
+    """A SourceGuard, configured like {"deadline": 45, "attempts": 3,
+       "failure_threshold": 3, "reset_timeout": 120, "stale_after": 600}."""
+    resilience_data = resilience_data or {}
+    breaker = resilience.CircuitBreaker(
+        name,
+        failure_threshold=resilience_data.get('failure_threshold', resilience.DEFAULT_FAILURE_THRESHOLD),
+        reset_timeout=resilience_data.get('reset_timeout', resilience.DEFAULT_RESET_TIMEOUT))
+    return resilience.SourceGuard(
+        name, session,
+        deadline=resilience_data.get('deadline', resilience.DEFAULT_DEADLINE),
+        attempts=resilience_data.get('attempts', resilience.DEFAULT_ATTEMPTS),
+        breaker=breaker,
+        stale_after=resilience_data.get('stale_after', resilience.DEFAULT_STALE_AFTER))
+
+
+def create_guards(jenkins, gerrit_instance, resilience_data=None):
+    """A SourceGuard per source. The servers of a federation are retried and paused
+       by their own guards, which also stand in their last results for a while, so
+       the federation as a whole is not: as soon as a server fails for good, only
+       what the others show bad stays, see poll_guarded."""
+    guards = {}
+    for (name, source) in (('jenkins', jenkins), ('gerrit', gerrit_instance)):
+        if isinstance(source, federation.Federation):
+            breaker = resilience.CircuitBreaker(name, failure_threshold=None)
+            guards[name] = resilience.SourceGuard(name, attempts=1, stale_after=0, breaker=breaker)
+        else:
+            guards[name] = create_guard(name, source.session, resilience_data)
+    return guards
+
+
+def poll_guarded(guard, fetch, post, poster, topics):
+    """Fetches through the guard, which may retry the fetch, and then returns
+       post(poster, result), which publishes it, once. If the fetch fails, and the
+       source has not been polled successfully for a while, the panels of the topics
+       are marked as unknown before the error is raised again. Those of a federation
+       with some servers missing show what the others have bad, and are unknown
+       otherwise."""
+    try:
+        result = guard.call(fetch)
+    except federation.ServersFailed as e:
+        if e.partial is not None:
+            post(poster.partial(), e.partial)
+        else:
+            for topic in topics:
+                poster.post_unknown(topic)
+        raise
+    except Exception:
+        if guard.is_stale():
+            for topic in topics:
+                poster.post_unknown(topic)
+        raise
+    return post(poster, result)
+
+
+def create_schedule(interval, adaptive_data):
+    return poll_schedule.AdaptiveSchedule(
+        interval,
+        min_interval=adaptive_data.get('min_interval', poll_schedule.DEFAULT_MIN_INTERVAL),
+        max_interval=adaptive_data.get('max_interval', poll_schedule.DEFAULT_MAX_INTERVAL))
+
+
+def create_poll_engine(jenkins, gerrit_instance, poster, schedule_data, adaptive_data=None,
+                       powersave=False, keep_alive=False, on_polled=None, guards=None,
+                       working_hours=None, keep_alive_interval=KEEP_ALIVE_INTERVAL):
+    """An alternative to MonitorThread, where each Jenkins job group and Gerrit is
+       polled on its own schedule. The schedule is configured per source, e.g.
+       {"build": {"interval": 15, "timeout": 30, "jitter": 0.1}}. With adaptive_data,
+       the intervals adapt between its min_interval and max_interval. The optional
+       on_polled is called after each poll of any source. The polls of each server
+       go through its guard from create_guards. With powersave, nothing is polled
+       outside the working_hours."""
+    guards = guards or create_guards(jenkins, gerrit_instance)
+    working_hours = working_hours or work_calendar.WorkingHours()
+
+    def post_group(topic, group):
+        def post(group_poster, statuses):
+            # The jobs of the group are looked up now, they may be selected by pattern
+            return (group_poster.post_jenkins_status(topic, *statuses[:3]),
+                    jenkins.get_time_to_finish(getattr(jenkins, group)))
+        return post
+
+    def post_changes(changes_poster, changes):
+        return (post_gerrit(changes_poster, changes), None)
+
+    def active():
+        return not powersave or working_hours.is_working()
+
+    def guarded(guard, fetch, post, topics):
+        def poll_through_guard():
+            result = poll_guarded(guard, fetch, post, poster, topics)
+            if on_polled:
+                on_polled()
+            return result
+        return poll_through_guard
+
+    def guarded_jenkins(fetch, topic, group):
+        return guarded(guards['jenkins'], fetch, post_group(topic, group), [topic])
+
+    engine = poll_engine.PollEngine()
+    sources = (('build', guarded_jenkins(jenkins.get_build_status,
+                                         monitor_status.UPDATE_BUILD_PUBSUB, 'build_jobs')),
+               ('ci_test', guarded_jenkins(jenkins.get_ci_test_status,
+                                           monitor_status.UPDATE_CI_TEST_PUBSUB, 'ci_test_jobs')),
+               ('other_tests', guarded_jenkins(jenkins.get_other_tests_status,
+                                               monitor_status.UPDATE_OTHER_TESTS_PUBSUB, 'other_test_jobs')),
+               ('gerrit', guarded(guards['gerrit'], gerrit_instance.all_open_changes, post_changes,
+                                  monitor_status.GERRIT_TOPICS)))
+    for (name, poll) in sources:
+        source_data = schedule_data.get(name, {})
+        interval = source_data.get('interval', DEFAULT_SCHEDULE[name])
+        engine.add(name, poll,
+                   interval=interval,
+                   timeout=source_data.get('timeout', poll_engine.DEFAULT_TIMEOUT),
+                   jitter=source_data.get('jitter', poll_engine.DEFAULT_JITTER),
+                   active=active,
+                   schedule=create_schedule(interval, adaptive_data) if adaptive_data else None,
+                   until_active=working_hours.seconds_until_change)
+
+    if keep_alive:
+        import pymouse
+        mouse = pymouse.PyMouse()
+        diffs = [MOUSE_DIFF]
+
+        def keep_screen_alive():
+            nudge_mouse(mouse, diffs[0])
+            diffs[0] = -diffs[0]  # Back and forth
+        engine.add('keep_alive', keep_screen_alive, interval=keep_alive_interval, jitter=0,
+                   active=active, until_active=working_hours.seconds_until_change)
+    return engine
 
 
 def read_config():
@@ -150,33 +377,317 @@ def read_config():
     return data
 
 
-def run_app(full_screen=True, top_window=False, powersave=False):
-    config_data = read_config()
+def read_working_hours():
+    """The working hours of mondrian.json, or the default ones if there is none,
+       e.g. on a display subscribing to a poller daemon."""
+    try:
+        config_data = read_config()
+    except IOError:
+        config_data = {}
+    return work_calendar.create(config_data.get('working_hours'))
+
+
+def server_list(server_data):
+    """The server sections of mondrian.json are either one server or a list of them."""
+    return server_data if isinstance(server_data, list) else [server_data]
+
+
+def create_session(server_data, http_data):
+    auth = (server_data['username'], server_data['password']) if 'username' in server_data else None
+    return http_session.HttpSession(
+        connect_timeout=http_data.get('connect_timeout', http_session.DEFAULT_CONNECT_TIMEOUT),
+        read_timeout=http_data.get('read_timeout', http_session.DEFAULT_READ_TIMEOUT),
+        max_per_host=server_data.get('max_connections', http_data.get('max_connections_per_host',
+                                                                      http_session.DEFAULT_MAX_PER_HOST)),
+        auth=auth)
+
+
+def create_jenkins(jenkins_data, session, cache):
+    return jenkins_status.JenkinsStatus(base_url=jenkins_data['base_url'],
+                                        build_jobs=jenkins_data['build_job_names'],
+                                        ci_test_jobs=jenkins_data['ci_test_job_names'],
+                                        other_test_jobs=jenkins_data['other_test_job_names'],
+                                        fetch_mode=jenkins_data.get('fetch_mode',
+                                                                    jenkins_status.FETCH_MODE_BULK),
+                                        workers=jenkins_data.get('workers', 0),
+                                        session=session,
+                                        cache=cache,
+                                        auth=session.auth,
+                                        job_index_interval=jenkins_data.get('job_index_interval',
+                                                                            job_index.DEFAULT_REFRESH_INTERVAL),
+                                        history_size=jenkins_data.get('history_size', job_history.DEFAULT_SIZE),
+                                        failure_rule=create_failure_rule(jenkins_data.get('failure_rule')))
+
+
+def create_failure_rule(rule_data):
+    if not rule_data:
+        return None
+    return job_history.FailureRule(rule_data['failures'], rule_data['of_last'])
+
+
+def create_gerrit(gerrit_data, session, cache):
+    base_url = gerrit_data['base_url'].rstrip('/')
+    if session.auth:
+        base_url += '/a'  # Where Gerrit serves its REST API to authenticated users
+    return gerrit.Gerrit(base_url=base_url,
+                         query_mode=gerrit_data.get('query_mode', gerrit.QUERY_MODE_LABELS),
+                         session=session,
+                         cache=cache,
+                         incremental=gerrit_data.get('incremental', False))
+
+
+def create_sources(config_data):
+    """Returns (sessions, cache, jenkins, gerrit) as configured in mondrian.json.
+       With several servers configured, jenkins and gerrit are federations of
+       them, polling the servers concurrently."""
+    http_data = config_data.get('http', {})
+    cache = response_cache.ResponseCache(
+        max_entries=http_data.get('cache_max_entries', response_cache.DEFAULT_MAX_ENTRIES),
+        ttls=http_data.get('cache_ttls'))
+    resilience_data = config_data.get('resilience')
+    sessions = []
+    sources = []
+    for (name, create, federation_class) in (('jenkins', create_jenkins, federation.JenkinsFederation),
+                                             ('gerrit', create_gerrit, federation.GerritFederation)):
+        members = []
+        for server_data in server_list(config_data[name]):
+            session = create_session(server_data, http_data)
+            sessions.append(session)
+            source = create(server_data, session, cache)
+            guard = create_guard('%s %s' % (name, server_data['base_url']), session, resilience_data)
+            members.append(federation.Member(source, guard, server_data.get('interval', 0)))
+        if len(members) == 1:
+            sources.append(members[0].source)
+        else:
+            sources.append(federation_class(members, cache))
+    return (sessions, cache, sources[0], sources[1])
+
+
+class Monitoring(object):
+    """Polls Jenkins and Gerrit, and receives their pushed events, as configured in
+       mondrian.json. The panel statuses go to the store, which passes on the changes."""
+
+    def __init__(self, config_data, store=None, powersave=False, keep_alive=False):
+        if store is None:
+            store = panel_state.PanelStateStore(monitor_status.send_to_view)
+        publish = store.publish
+        self.reporter = None
+        metrics_data = config_data.get('metrics')
+        if metrics_data:
+            self.reporter = metrics.MetricsReporter(port=metrics_data.get('port'),
+                                                    log_interval=metrics_data.get('log_interval'))
+            self.reporter.start()
+
+        (sessions, cache, jenkins, gerrit_instance) = create_sources(config_data)
+        gerrit_data = server_list(config_data['gerrit'])[0]  # The limits are for all servers
+        self.snapshot = None
+        snapshot_data = config_data.get('snapshot')
+        if snapshot_data is not None:
+            self.snapshot = snapshot.Snapshot(store, jenkins, gerrit_instance, cache,
+                                              file_name=snapshot_data.get('file', snapshot.DEFAULT_FILE),
+                                              max_age=snapshot_data.get('max_age', snapshot.DEFAULT_MAX_AGE))
+            self.snapshot.restore()
+        on_polled = self.snapshot.save if self.snapshot else None
+        guards = create_guards(jenkins, gerrit_instance, config_data.get('resilience'))
+
+        poster = monitor_status.StatusPoster(gerrit_data['limits_ready_for_review'],
+                                             gerrit_data['limits_reviewed'],
+                                             publish)
+        working_hours = work_calendar.create(config_data.get('working_hours'))
+        keep_alive_interval = config_data.get('keep_alive_interval', KEEP_ALIVE_INTERVAL)
+        schedule_data = config_data.get('schedule', {})
+        adaptive_data = config_data.get('adaptive_schedule')
+        poll_interval = SECONDS_BETWEEN_POLLS
+        receiver = None
+        push_data = config_data.get('push')
+        if push_data:
+            # Pushed events keep the panels up to date, polls only reconcile now and then
+            poll_interval = push_data.get('reconcile_interval', push_receiver.DEFAULT_RECONCILE_INTERVAL)
+            schedule_data = dict((name, dict(schedule_data.get(name, {}), interval=poll_interval))
+                                 for name in DEFAULT_SCHEDULE)
+            if adaptive_data is not None:
+                adaptive_data = dict(adaptive_data, min_interval=poll_interval,
+                                     max_interval=max(poll_interval, adaptive_data.get(
+                                         'max_interval', poll_schedule.DEFAULT_MAX_INTERVAL)))
+
+        if config_data.get('poll_engine') == 'tasks':
+            monitor = create_poll_engine(jenkins, gerrit_instance, poster, schedule_data,
+                                         adaptive_data=adaptive_data,
+                                         powersave=powersave, keep_alive=keep_alive,
+                                         on_polled=on_polled, guards=guards,
+                                         working_hours=working_hours,
+                                         keep_alive_interval=keep_alive_interval)
+            monitor.start()
+        else:
+            if push_data and adaptive_data is None:
+                adaptive_data = {'min_interval': poll_interval,
+                                 'max_interval': max(poll_interval, poll_schedule.DEFAULT_MAX_INTERVAL)}
+            monitor = MonitorThread(jenkins,
+                                    gerrit_instance,
+                                    gerrit_data['limits_ready_for_review'],
+                                    gerrit_data['limits_reviewed'],
+                                    powersave=powersave,
+                                    keep_alive=keep_alive,
+                                    schedule=create_schedule(poll_interval, adaptive_data or {}),
+                                    publish=publish,
+                                    on_polled=on_polled,
+                                    guards=guards,
+                                    working_hours=working_hours,
+                                    keep_alive_interval=keep_alive_interval)
+        if push_data:
+            if config_data.get('poll_engine') == 'tasks':
+                sync_gerrit = functools.partial(monitor.wake, 'gerrit')
+            else:
+                sync_gerrit = monitor.wake
+            receiver = push_receiver.PushReceiver(jenkins, gerrit_instance, poster,
+                                                  port=push_data.get('port', push_receiver.DEFAULT_PORT),
+                                                  sync_gerrit=sync_gerrit)
+            receiver.start()
+        self.idle_watcher = None
+        if powersave:
+            # Tells the view when the display may be off, so that it can rest too
+            self.idle_watcher = IdleWatcher(working_hours, publish)
+            self.idle_watcher.start()
+
+        self.sessions = sessions
+        self.receiver = receiver
+        self.monitor = monitor
 
-    jenkins_data = config_data['jenkins']
-    jenkins = jenkins_status.JenkinsStatus(base_url=jenkins_data['base_url'],
-                                           build_jobs=jenkins_data['build_job_names'],
-                                           ci_test_jobs=jenkins_data['ci_test_job_names'],
-                                           other_test_jobs=jenkins_data['other_test_job_names'])
+    def stop(self):
+        if self.idle_watcher:
+            self.idle_watcher.stop()
+        if self.receiver:
+            self.receiver.stop()
+        self.monitor.stop()
+        self.monitor.join()
+        if self.snapshot:
+            self.snapshot.save(force=True)
+        for session in self.sessions:
+            session.close()
+        if self.reporter:
+            self.reporter.stop()
+
+
+def run_app(full_screen=True, top_window=False, powersave=False, subscribe_url=None,
+            renderer='panels'):
+    store = panel_state.PanelStateStore(monitor_status.send_to_view)
+    idle_watcher = None
+    if subscribe_url:
+        working_hours = None
+        if powersave:
+            # The view rests outside the working hours, and nothing is asked meanwhile
+            working_hours = read_working_hours()
+            idle_watcher = IdleWatcher(working_hours, store.publish)
+            idle_watcher.start()
+        monitor = state_server.StateSubscriber(subscribe_url, publish=store.publish,
+                                               working_hours=working_hours)
+    else:
+        monitor = Monitoring(read_config(), store=store, powersave=powersave, keep_alive=full_screen)
+
+    import monitor_view
+    monitor_view.run(full_screen, top_window, on_ready=store.republish, renderer=renderer)
+    if idle_watcher:
+        idle_watcher.stop()
+    monitor.stop()
 
-    gerrit_data = config_data['gerrit']
-    gerrit_instance = gerrit.Gerrit(base_url=gerrit_data['base_url'])
-    monitor = MonitorThread(jenkins,
-                            gerrit_instance,
-                            gerrit_data['limits_ready_for_review'],
-                            gerrit_data['limits_reviewed'],
-                            powersave=powersave,
-                            keep_alive=full_screen)
 
-    monitor_view.run(full_screen, top_window)
-    monitor.stop()
-    monitor.join()
+def poll_once(config_data, with_history=False):
+    """Polls all servers once, without any threads or display. Returns the panel
+       states, {topic: status}, and with_history the history of each job,
+       {job: summary}, or None. The panels of a server that could not be polled
+       are unknown, as those of a federation with such a server, unless the others
+       already show them bad."""
+    (sessions, _, jenkins, gerrit_instance) = create_sources(config_data)
+    history = None
+    gerrit_data = server_list(config_data['gerrit'])[0]
+    store = panel_state.PanelStateStore()
+    poster = monitor_status.StatusPoster(gerrit_data['limits_ready_for_review'],
+                                         gerrit_data['limits_reviewed'],
+                                         store.publish)
+    try:
+        if with_history:
+            jenkins.seed_history()
+        guards = create_guards(jenkins, gerrit_instance, config_data.get('resilience'))
+        for (name, fetch, post, topics) in (
+                ('jenkins', jenkins.get_all_status, post_jenkins, monitor_status.JENKINS_TOPICS),
+                ('gerrit', gerrit_instance.all_open_changes, post_gerrit, monitor_status.GERRIT_TOPICS)):
+            try:
+                poll_guarded(guards[name], fetch, post, poster, topics)
+            except Exception as e:  # The panels are unknown then, the other source goes on
+                logging.warning('%s poll failed:\n%s', name, str(e))
+        if with_history:
+            history = jenkins.get_history(jenkins.build_jobs + jenkins.ci_test_jobs + jenkins.other_test_jobs)
+    finally:
+        for session in sessions:
+            session.close()
+    return (store.get_states()[1], history)
+
+
+def run_once(as_json=False, with_history=False):
+    (states, history) = poll_once(read_config(), with_history)
+    panels = dict((topic, monitor_status.STATUS_NAMES[status]) for (topic, status) in states.items())
+    if as_json:
+        if with_history:
+            print json.dumps({'panels': panels, 'history': history}, sort_keys=True)
+        else:
+            print json.dumps(panels, sort_keys=True)
+        return
+    for topic in monitor_status.PANEL_TOPICS:
+        print '%s: %s' % (topic, panels[topic])
+    if with_history:
+        for job in sorted(history):
+            job_summary = history[job]
+            print '%s: %s, flakiness %.2f, %s for %d s' % (
+                job, ' '.join(result or '?' for result in job_summary['results']),
+                job_summary['flakiness'], job_summary['results'][-1], job_summary['seconds_in_state'])
+
+
+def run_daemon(port=state_server.DEFAULT_PORT, powersave=False):
+    """Polls once for many displays: serves the panel states to Mondrian
+       instances started with --subscribe. Does not need wx."""
+    states = state_server.PanelStates()
+    monitoring = Monitoring(read_config(), store=states, powersave=powersave)
+    server = state_server.StateServer(states, port)
+
+    def shutdown_when_requested():
+        states.shutdown_requested.wait()
+        server.shutdown()
+    watcher = threading.Thread(target=shutdown_when_requested)
+    watcher.daemon = True
+    watcher.start()
+
+    logging.info('serving panel states on port %d', port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        monitoring.stop()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Display a monitor of Jenkins and Gerrit status.')
+    parser.add_argument('command', nargs='?', choices=['display', 'serve'], default='display',
+                        help='"serve" runs a poller without display, serving the status to ' +
+                             'displays started with --subscribe.')
     parser.add_argument('-p', '--powersave', action='store_true', default=False,
                         help='Stops monitoring outside "office hours".')
+    parser.add_argument('-s', '--subscribe', metavar='URL',
+                        help='Take the status from a poller started with "serve", e.g. ' +
+                             'http://poller:%d, instead of polling the servers.' % state_server.DEFAULT_PORT)
+    parser.add_argument('--port', type=int, default=state_server.DEFAULT_PORT,
+                        help='The port to serve the status on, for "serve".')
+    parser.add_argument('--once', action='store_true', default=False,
+                        help='Poll once without display, print the status of each field and exit.')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='With --once, print the status as JSON.')
+    parser.add_argument('--history', action='store_true', default=False,
+                        help='With --once, also print the latest results, flakiness and ' +
+                             'time in the current state of each job.')
+    parser.add_argument('-r', '--renderer', choices=['panels', 'canvas'], default='panels',
+                        help='"canvas" draws all fields on one double buffered window, ' +
+                             'lighter on e.g. a Raspberry Pi.')
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-f', '--fullscreen', action='store_true', default=False,
                        help='Start the monitor in full screen mode, trying to keep the screen' +
@@ -186,4 +697,11 @@ if __name__ == "__main__":
                             'Close with Esc key.')
     args = parser.parse_args()
 
-    run_app(full_screen=args.fullscreen, top_window=args.top, powersave=args.powersave)
+    if args.once:
+        run_once(as_json=args.json, with_history=args.history)
+    elif args.command == 'serve':
+        logging.basicConfig(level=logging.INFO)
+        run_daemon(port=args.port, powersave=args.powersave)
+    else:
+        run_app(full_screen=args.fullscreen, top_window=args.top, powersave=args.powersave,
+                subscribe_url=args.subscribe, renderer=args.renderer)
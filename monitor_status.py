@@ -0,0 +1,113 @@
+import metrics
+
+# The panel statuses and the pubsub topics updating them. They live here,
+# rather than in monitor_view, so that monitoring without a display needs no wx.
+STATUS_GOOD = 0
+STATUS_ALMOST_GOOD = 1
+STATUS_ALMOST_BAD = 2
+STATUS_BAD = 3
+STATUS_UNKNOWN = 4  # Not polled yet, or the source has been failing for a while
+
+SHUTDOWN_PUBSUB = "shutdown"
+IDLE_PUBSUB = "idle"  # idle=True while the display may be off, outside working hours
+UPDATE_BUILD_PUBSUB = "update_build"
+UPDATE_CI_TEST_PUBSUB = "update_ci_test"
+UPDATE_OTHER_TESTS_PUBSUB = "update_other_test"
+UPDATE_GERRIT_FOR_REVIEW_PUBSUB = "update_ready_for_review"
+UPDATE_GERRIT_REVIEWED_PUBSUB = "update_reviewed"
+
+JENKINS_TOPICS = (UPDATE_BUILD_PUBSUB, UPDATE_CI_TEST_PUBSUB, UPDATE_OTHER_TESTS_PUBSUB)
+GERRIT_TOPICS = (UPDATE_GERRIT_FOR_REVIEW_PUBSUB, UPDATE_GERRIT_REVIEWED_PUBSUB)
+
+PANEL_TOPICS = (UPDATE_BUILD_PUBSUB,
+                UPDATE_CI_TEST_PUBSUB,
+                UPDATE_OTHER_TESTS_PUBSUB,
+                UPDATE_GERRIT_FOR_REVIEW_PUBSUB,
+                UPDATE_GERRIT_REVIEWED_PUBSUB)
+
+
+STATUS_NAMES = {STATUS_GOOD: 'good',
+                STATUS_ALMOST_GOOD: 'almost_good',
+                STATUS_ALMOST_BAD: 'almost_bad',
+                STATUS_BAD: 'bad',
+                STATUS_UNKNOWN: 'unknown'}
+
+
+def get_publisher():
+    """The pubsub module, the standalone PyPubSub if installed, else the copy in wx.
+       Imported when first needed, so that nothing without a view loads wx."""
+    try:
+        from pubsub import pub
+    except ImportError:
+        from wx.lib.pubsub import pub
+    return pub
+
+
+def send_to_view(topic, **kwargs):
+    get_publisher().sendMessage(topic, **kwargs)
+
+
+class StatusPoster(object):
+    """Turns Jenkins and Gerrit poll results into panel statuses, and
+       publishes them, by default to the view. The post methods return the status."""
+
+    def __init__(self, gerrit_for_review_limits, gerrit_reviewed_limits, publish=send_to_view):
+        self.gerrit_for_review_limits = gerrit_for_review_limits
+        self.gerrit_reviewed_limits = gerrit_reviewed_limits
+        self.publish = publish
+
+    def send(self, topic, view_status):
+        metrics.mark('panel_update', topic)
+        self.publish(topic, status=view_status)
+        return view_status
+
+    def post_unknown(self, topic):
+        return self.send(topic, STATUS_UNKNOWN)
+
+    def partial(self):
+        """A poster for results that lack some servers, see PartialStatusPoster."""
+        return PartialStatusPoster(self.gerrit_for_review_limits, self.gerrit_reviewed_limits, self.publish)
+
+    def post_jenkins_status(self, job_pubsub, successes, unstable, failures):
+        if len(failures) != 0:
+            view_status = STATUS_BAD
+        elif len(unstable) != 0:
+            view_status = STATUS_ALMOST_BAD
+        elif len(successes) > 0:
+            view_status = STATUS_GOOD
+        else:
+            view_status = STATUS_ALMOST_GOOD
+        return self.send(job_pubsub, view_status)
+
+    def post_ready_for_review_status(self, status):
+        if status == self.gerrit_for_review_limits['good']:
+            view_status = STATUS_GOOD
+        elif status < self.gerrit_for_review_limits['almost_good']:
+            view_status = STATUS_ALMOST_GOOD
+        elif status < self.gerrit_for_review_limits['almost_bad']:
+            view_status = STATUS_ALMOST_BAD
+        else:
+            view_status = STATUS_BAD
+        return self.send(UPDATE_GERRIT_FOR_REVIEW_PUBSUB, view_status)
+
+    def post_reviewed_status(self, status):
+        if status == self.gerrit_reviewed_limits['good']:
+            view_status = STATUS_GOOD
+        elif status < self.gerrit_reviewed_limits['almost_good']:
+            view_status = STATUS_ALMOST_GOOD
+        elif status < self.gerrit_reviewed_limits['almost_bad']:
+            view_status = STATUS_ALMOST_BAD
+        else:
+            view_status = STATUS_BAD
+        return self.send(UPDATE_GERRIT_REVIEWED_PUBSUB, view_status)
+
+
+class PartialStatusPoster(StatusPoster):
+    """Posts results that lack some servers: a status that the missing results
+       could not make any better (failed jobs, too many changes) is posted as
+       it is, any other as unknown."""
+
+    def send(self, topic, view_status):
+        if view_status != STATUS_BAD:
+            view_status = STATUS_UNKNOWN
+        return StatusPoster.send(self, topic, view_status)
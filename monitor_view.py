@@ -1,35 +1,40 @@
 import logging
+import threading
+import time
 import wx
-from wx.lib.pubsub import pub as Publisher
+
+import metrics
+import monitor_status
+from monitor_status import STATUS_GOOD, STATUS_ALMOST_GOOD, STATUS_ALMOST_BAD, STATUS_BAD, \
+    STATUS_UNKNOWN
+from monitor_status import SHUTDOWN_PUBSUB, IDLE_PUBSUB, UPDATE_BUILD_PUBSUB, UPDATE_CI_TEST_PUBSUB, \
+    UPDATE_OTHER_TESTS_PUBSUB, UPDATE_GERRIT_FOR_REVIEW_PUBSUB, UPDATE_GERRIT_REVIEWED_PUBSUB
+
+Publisher = monitor_status.get_publisher()
 
 MONITOR_RELATIVE_SIZE = 0.2
 MONITOR_EDGE_MARGIN = 20
 
-STATUS_GOOD = 0
-STATUS_ALMOST_GOOD = 1
-STATUS_ALMOST_BAD = 2
-STATUS_BAD = 3
-
 COLOUR_STATUS_GOOD = 'white'
 COLOUR_STATUS_ALMOST_GOOD = 'blue'
 COLOUR_STATUS_ALMOST_BAD = 'yellow'
 COLOUR_STATUS_BAD = 'red'
+COLOUR_STATUS_UNKNOWN = 'grey'
 LINE_COLOUR = 'black'
 
 status_colour = {STATUS_GOOD : COLOUR_STATUS_GOOD,
                  STATUS_ALMOST_GOOD : COLOUR_STATUS_ALMOST_GOOD,
                  STATUS_ALMOST_BAD : COLOUR_STATUS_ALMOST_BAD,
-                 STATUS_BAD : COLOUR_STATUS_BAD}
+                 STATUS_BAD : COLOUR_STATUS_BAD,
+                 STATUS_UNKNOWN : COLOUR_STATUS_UNKNOWN}
 
 LINE_WIDTH_PART = 0.01
 
-SHUTDOWN_PUBSUB = "shutdown"
 RESIZE_PUBSUB = "resize"
-UPDATE_BUILD_PUBSUB = "update_build"
-UPDATE_CI_TEST_PUBSUB = "update_ci_test"
-UPDATE_OTHER_TESTS_PUBSUB = "update_other_test"
-UPDATE_GERRIT_FOR_REVIEW_PUBSUB = "update_ready_for_review"
-UPDATE_GERRIT_REVIEWED_PUBSUB = "update_reviewed"
+RESIZE_DEBOUNCE_MILLISECONDS = 150
+
+RENDERER_PANELS = 'panels'
+RENDERER_CANVAS = 'canvas'
 
 
 # This defines how much space each "column/row" should take, the proportions.
@@ -54,9 +59,13 @@ class MonitorPanel(wx.Panel):
         self.Bind(wx.EVT_PAINT, self.on_paint)
         self.line_width = 5  # Initial width, updated through resize pubsub
         self.SetBackgroundColour(COLOUR_STATUS_GOOD)
+        self.published = None  # When the status now waiting to be painted was published
         Publisher.subscribe(self.update_line_width, RESIZE_PUBSUB)
 
     def on_paint(self, event):
+        if self.published:
+            metrics.observe('repaint_latency_seconds', time.time() - self.published)
+            self.published = None
         (width, height) = self.GetSize()
         dc = wx.PaintDC(self)
         pen = wx.Pen(LINE_COLOUR, width=self.line_width)
@@ -68,7 +77,71 @@ class MonitorPanel(wx.Panel):
         self.line_width = line_width
 
 
-class MainPanel(wx.Panel):
+class StatusDisplay(object):
+    """Takes the panel updates from the poll threads. Updates arriving together are
+       applied in one go, by one call on the UI thread, to the update_panel(topic,
+       colour, published) given to subscribe_updates. While idle, e.g. with the
+       display off, they are kept until it is over."""
+
+    def subscribe_updates(self, update_panel):
+        self.apply_update = update_panel
+        self.pending = {}  # Topic -> (colour, when published), waiting for the UI thread
+        self.pending_lock = threading.Lock()
+        self.flush_scheduled = False
+        self.idle = False
+
+        Publisher.subscribe(self.set_idle, IDLE_PUBSUB)
+        Publisher.subscribe(self.update_build_display, UPDATE_BUILD_PUBSUB)
+        Publisher.subscribe(self.update_ci_test_display, UPDATE_CI_TEST_PUBSUB)
+        Publisher.subscribe(self.update_other_test_display, UPDATE_OTHER_TESTS_PUBSUB)
+        Publisher.subscribe(self.update_ready_for_review_display, UPDATE_GERRIT_FOR_REVIEW_PUBSUB)
+        Publisher.subscribe(self.update_reviewed_display, UPDATE_GERRIT_REVIEWED_PUBSUB)
+
+    def queue_update(self, topic, status):
+        with self.pending_lock:
+            self.pending[topic] = (status_colour[status], time.time())
+            if self.flush_scheduled or self.idle:
+                return
+            self.flush_scheduled = True
+        wx.CallAfter(self.flush_updates)
+
+    def set_idle(self, idle):
+        with self.pending_lock:
+            self.idle = idle
+            if idle or self.flush_scheduled or not self.pending:
+                return
+            self.flush_scheduled = True
+        wx.CallAfter(self.flush_updates)
+
+    def flush_updates(self):
+        with self.pending_lock:
+            (pending, self.pending) = (self.pending, {})
+            self.flush_scheduled = False
+        for (topic, (colour, published)) in pending.items():
+            self.apply_update(topic, colour, published)
+
+    def update_build_display(self, status):
+        logging.debug('build status: %d', status)
+        self.queue_update(UPDATE_BUILD_PUBSUB, status)
+
+    def update_ci_test_display(self, status):
+        logging.debug('ci test status: %d', status)
+        self.queue_update(UPDATE_CI_TEST_PUBSUB, status)
+
+    def update_other_test_display(self, status):
+        logging.debug('other test status: %d', status)
+        self.queue_update(UPDATE_OTHER_TESTS_PUBSUB, status)
+
+    def update_ready_for_review_display(self, status):
+        logging.debug('ready for review status: %d', status)
+        self.queue_update(UPDATE_GERRIT_FOR_REVIEW_PUBSUB, status)
+
+    def update_reviewed_display(self, status):
+        logging.debug('reviewed status: %d', status)
+        self.queue_update(UPDATE_GERRIT_REVIEWED_PUBSUB, status)
+
+
+class MainPanel(wx.Panel, StatusDisplay):
 
     def __init__(self, parent):
         """The main panel. It contains a number ow panels arranged in a Mondrian like fashion.
@@ -113,41 +186,126 @@ class MainPanel(wx.Panel):
         self.SetSizer(box)
         self.Layout()
 
-        Publisher.subscribe(self.update_build_display, UPDATE_BUILD_PUBSUB)
-        Publisher.subscribe(self.update_ci_test_display, UPDATE_CI_TEST_PUBSUB)
-        Publisher.subscribe(self.update_other_test_display, UPDATE_OTHER_TESTS_PUBSUB)
-        Publisher.subscribe(self.update_ready_for_review_display, UPDATE_GERRIT_FOR_REVIEW_PUBSUB)
-        Publisher.subscribe(self.update_reviewed_display, UPDATE_GERRIT_REVIEWED_PUBSUB)
-
-    def update_panel(self, panel, colour):
+        self.panels = {UPDATE_BUILD_PUBSUB: self.jenkins_build_panel,
+                       UPDATE_CI_TEST_PUBSUB: self.jenkins_ci_test_panel,
+                       UPDATE_OTHER_TESTS_PUBSUB: self.jenkins_other_test_panel,
+                       UPDATE_GERRIT_FOR_REVIEW_PUBSUB: self.gerrit_for_review_panel,
+                       UPDATE_GERRIT_REVIEWED_PUBSUB: self.gerrit_reviewed_panel}
+        for panel in self.panels.values():
+            panel.SetBackgroundColour(COLOUR_STATUS_UNKNOWN)  # Until the first status
+        self.subscribe_updates(self.update_panel)
+
+    def update_panel(self, topic, colour, published):
+        panel = self.panels[topic]
+        if panel.GetBackgroundColour() == wx.Colour(colour):
+            return
+        panel.published = published
         panel.SetBackgroundColour(colour)
         panel.Refresh()
 
-    def update_build_display(self, status):
-        logging.debug('build status: %d', status)
-        wx.CallAfter(self.update_panel, self.jenkins_build_panel, status_colour[status])
 
-    def update_ci_test_display(self, status):
-        logging.debug('ci test status: %d', status)
-        wx.CallAfter(self.update_panel, self.jenkins_ci_test_panel, status_colour[status])
+def split(start, length, weights):
+    """Divides length in parts proportional to weights. Returns (start, length) of each."""
+    total = float(sum(weights))
+    edges = [start + int(round(length * sum(weights[:i]) / total)) for i in range(len(weights) + 1)]
+    return [(edges[i], edges[i + 1] - edges[i]) for i in range(len(weights))]
 
-    def update_other_test_display(self, status):
-        logging.debug('other test status: %d', status)
-        wx.CallAfter(self.update_panel, self.jenkins_other_test_panel, status_colour[status])
 
-    def update_ready_for_review_display(self, status):
-        logging.debug('ready for review status: %d', status)
-        wx.CallAfter(self.update_panel, self.gerrit_for_review_panel, status_colour[status])
+class MondrianCanvas(wx.Panel, StatusDisplay):
+    """The same layout as MainPanel, drawn in one double buffered paint on a single
+       window. A status change only repaints the field that changed."""
 
-    def update_reviewed_display(self, status):
-        logging.debug('reviewed status: %d', status)
-        wx.CallAfter(self.update_panel, self.gerrit_reviewed_panel, status_colour[status])
+    def __init__(self, parent):
+        wx.Panel.__init__(self, parent)
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT)  # All drawing is done in on_paint
+        self.Bind(wx.EVT_PAINT, self.on_paint)
+        self.line_width = 5  # Initial width, updated through resize pubsub
+        self.pen = None
+        self.outline_brush = wx.Brush(LINE_COLOUR, style=wx.TRANSPARENT)
+        self.brushes = {}  # Colour -> brush
+        self.colours = dict((topic, COLOUR_STATUS_UNKNOWN) for topic in monitor_status.PANEL_TOPICS)
+        self.fields = []  # (topic or None for the decorative ones, wx.Rect)
+        self.published = {}  # Topic -> when the status now waiting to be painted was published
+        Publisher.subscribe(self.update_line_width, RESIZE_PUBSUB)
+        self.subscribe_updates(self.update_panel)
+
+    def layout(self):
+        (width, height) = self.GetClientSize()
+        columns = split(0, width, (FIRST_COLUMN_WEIGHT, SECOND_COLUMN_WEIGHT, THIRD_COLUMN_WEIGHT))
+        rows = split(0, height, (FIRST_ROW_WEIGHT, SECOND_ROW_WEIGHT, THIRD_ROW_WEIGHT))
+
+        def cell(column, row):
+            return (columns[column][0], rows[row][0], columns[column][1], rows[row][1])
+
+        (x, y, w, h) = cell(2, 1)
+        (ci_test, other_tests) = split(y, h, (JENKINS_CI_TEST_WEIGHT, JENKINS_OTHER_TESTS_WEIGHT))
+        (x2, y2, w2, h2) = cell(1, 2)
+        (for_review, reviewed) = split(x2, w2, (GERRIT_FOR_REVIEW_WEIGHT, GERRIT_REVIEWED_WEIGHT))
+        fields = [(None, cell(0, 0)), (None, cell(1, 0)), (None, cell(2, 0)),
+                  (None, cell(0, 1)), (UPDATE_BUILD_PUBSUB, cell(1, 1)),
+                  (UPDATE_CI_TEST_PUBSUB, (x, ci_test[0], w, ci_test[1])),
+                  (UPDATE_OTHER_TESTS_PUBSUB, (x, other_tests[0], w, other_tests[1])),
+                  (None, cell(0, 2)),
+                  (UPDATE_GERRIT_FOR_REVIEW_PUBSUB, (for_review[0], y2, for_review[1], h2)),
+                  (UPDATE_GERRIT_REVIEWED_PUBSUB, (reviewed[0], y2, reviewed[1], h2)),
+                  (None, cell(2, 2))]
+        self.fields = [(topic, wx.Rect(*rect)) for (topic, rect) in fields]
+
+    def brush(self, colour):
+        if colour not in self.brushes:
+            self.brushes[colour] = wx.Brush(colour)
+        return self.brushes[colour]
+
+    def on_paint(self, event):
+        now = time.time()
+        for published in self.published.values():
+            metrics.observe('repaint_latency_seconds', now - published)
+        self.published.clear()
+        if not self.fields:
+            self.layout()
+        if self.pen is None:
+            self.pen = wx.Pen(LINE_COLOUR, width=self.line_width)
+        dc = wx.AutoBufferedPaintDC(self)
+        region = self.GetUpdateRegion()
+        # The lines are drawn after all fills, so that no field paints over the
+        # half of its neighbour's line that falls on its side
+        visible = [(topic, rect) for (topic, rect) in self.fields
+                   if region.ContainsRect(self.border(rect)) != wx.OutRegion]
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        for (topic, rect) in visible:
+            dc.SetBrush(self.brush(self.colours.get(topic, COLOUR_STATUS_GOOD)))
+            dc.DrawRectangle(rect.x, rect.y, rect.width, rect.height)
+        dc.SetPen(self.pen)
+        dc.SetBrush(self.outline_brush)
+        for (topic, rect) in visible:
+            dc.DrawRectangle(rect.x, rect.y, rect.width, rect.height)
+
+    def border(self, rect):
+        """The rectangle with its line on the outside."""
+        border = wx.Rect(rect.x, rect.y, rect.width, rect.height)
+        border.Inflate(int(self.line_width / 2) + 1, int(self.line_width / 2) + 1)
+        return border
+
+    def update_panel(self, topic, colour, published):
+        if self.colours[topic] == colour:
+            return
+        self.colours[topic] = colour
+        self.published[topic] = published
+        for (field_topic, rect) in self.fields:
+            if field_topic == topic:
+                self.RefreshRect(self.border(rect), eraseBackground=False)
+
+    def update_line_width(self, line_width):
+        self.line_width = line_width
+        self.pen = None
+        self.layout()
+        self.Refresh(eraseBackground=False)
 
 
 class MyForm(wx.Frame):
     """The main form. Possible to run full screen. Posts updates of new 'Mondrian line
-       width' when resizing."""
-    def __init__(self, full_screen=True, top_window=False):
+       width' when resizing, once the size has settled."""
+    def __init__(self, full_screen=True, top_window=False, renderer=RENDERER_PANELS):
 
         if top_window:
             win_style = wx.CLIP_CHILDREN | wx.STAY_ON_TOP | wx.FRAME_NO_TASKBAR | \
@@ -164,10 +322,12 @@ class MyForm(wx.Frame):
         self.Bind(wx.EVT_CHAR_HOOK, self.on_key)
 
         self.Bind(wx.EVT_SIZE, self.on_size)
+        self.resize_timer = None
 
         Publisher.subscribe(self.shutdown, SHUTDOWN_PUBSUB)
+        Publisher.subscribe(self.set_idle, IDLE_PUBSUB)
 
-        MainPanel(self)
+        renderers[renderer](self)
         self.Show()
 
         if full_screen:
@@ -184,6 +344,22 @@ class MyForm(wx.Frame):
     def shutdown(self):
         self.Close()
 
+    def set_idle(self, idle):
+        wx.CallAfter(self.rest if idle else self.wake_up)
+
+    def rest(self):
+        """Stops the timers and repaints while the display may be off."""
+        if self.resize_timer and self.resize_timer.IsRunning():
+            self.resize_timer.Stop()
+        if not self.IsFrozen():
+            self.Freeze()
+
+    def wake_up(self):
+        if self.IsFrozen():
+            self.Thaw()
+        self.update_line_width()  # In case it was resized while resting
+        self.Refresh()
+
     def on_key(self, event):
         key_code = event.GetKeyCode()
         if key_code == wx.WXK_ESCAPE:
@@ -192,7 +368,10 @@ class MyForm(wx.Frame):
             event.Skip()
 
     def on_size(self, event):
-        self.update_line_width()
+        if self.resize_timer is None:
+            self.resize_timer = wx.CallLater(RESIZE_DEBOUNCE_MILLISECONDS, self.update_line_width)
+        else:
+            self.resize_timer.Restart(RESIZE_DEBOUNCE_MILLISECONDS)
         event.Skip()
 
     def update_line_width(self):
@@ -200,9 +379,17 @@ class MyForm(wx.Frame):
         Publisher.sendMessage(RESIZE_PUBSUB, line_width=new_line_width)
 
 
-def run(full_screen=True, top_window=False):
+renderers = {RENDERER_PANELS: MainPanel,
+             RENDERER_CANVAS: MondrianCanvas}
+
+
+def run(full_screen=True, top_window=False, on_ready=None, renderer=RENDERER_PANELS):
+    """on_ready is called once the view listens for updates, e.g. to resend
+       statuses published before that."""
     app = wx.App()
-    MyForm(full_screen, top_window)
+    MyForm(full_screen, top_window, renderer)
+    if on_ready:
+        on_ready()
     app.MainLoop()
 
 
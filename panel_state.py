@@ -0,0 +1,46 @@
+import threading
+
+
+class PanelStateStore(object):
+    """The last status of each panel, between the pollers and the view. Only
+       real changes are forwarded, so a poll finding everything as it was
+       costs the view nothing. The version is bumped on each change. Changes
+       are forwarded under the lock, so a topic's updates reach the view in
+       the order they were stored."""
+
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.states = {}    # topic -> status
+        self.version = 0
+        self.changed = threading.Condition()
+
+    def publish(self, topic, **kwargs):
+        """Works as the publish function of a StatusPoster. Returns True if the
+           status was a change."""
+        if 'status' not in kwargs:  # Not a panel update, e.g. shutdown
+            if self.forward:
+                with self.changed:
+                    self.forward(topic, **kwargs)
+            return False
+        status = kwargs['status']
+        with self.changed:
+            if topic in self.states and self.states[topic] == status:
+                return False
+            self.version += 1
+            self.states[topic] = status
+            self.changed.notify_all()
+            if self.forward:
+                self.forward(topic, status=status)
+        return True
+
+    def get_states(self):
+        """Returns (version, {topic: status})."""
+        with self.changed:
+            return (self.version, dict(self.states))
+
+    def republish(self):
+        """Forwards all known states again, e.g. to a view that just started."""
+        if self.forward:
+            with self.changed:
+                for (topic, status) in self.states.items():
+                    self.forward(topic, status=status)
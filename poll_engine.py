@@ -0,0 +1,118 @@
+import logging
+import random
+import threading
+
+import idle
+import metrics
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_JITTER = 0.1  # Part of the interval
+START_DELAY = 1  # Just to give the view time to subscribe
+
+
+class PollTask(threading.Thread):
+    """Polls one source every interval seconds, give or take some jitter, so
+       that a slow source does not hold up the others. A poll running longer
+       than the timeout is given up on, and no new poll of the source starts
+       until it has finished.
+       With an AdaptiveSchedule, the interval comes from the schedule instead,
+       and the poll function returns (state, time_to_finish) for it.
+       While not active, it sleeps for until_active() seconds, if given, e.g.
+       until the working hours start, rather than checking every interval.
+       wake() cuts the sleep short, to poll right away if active."""
+
+    def __init__(self, name, poll, interval, timeout=DEFAULT_TIMEOUT, jitter=DEFAULT_JITTER,
+                 active=None, schedule=None, until_active=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.poll = poll
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter = jitter
+        self.active = active  # Optional, polls only when this returns True
+        self.schedule = schedule
+        self.until_active = until_active
+        self.worker = None
+        self.stopped = False
+        self.wakeup = idle.event()
+
+    def run(self):
+        self.sleep(START_DELAY)
+        while not self.stopped:
+            if self.active is None or self.active():
+                self.poll_once()
+            elif self.until_active:
+                self.sleep(self.until_active())
+                continue
+            self.sleep(self.next_delay())
+        logging.debug('%s: done polling', self.name)
+
+    def sleep(self, seconds):
+        self.wakeup.wait(seconds)
+        self.wakeup.clear()
+
+    def next_delay(self):
+        interval = self.schedule.interval if self.schedule else self.interval
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def poll_once(self):
+        if self.worker and self.worker.is_alive():
+            logging.warning('%s: previous poll still running', self.name)
+            return
+        self.worker = threading.Thread(target=self.call_poll, name=self.name + '-poll')
+        self.worker.daemon = True
+        self.worker.start()
+        self.worker.join(self.timeout)
+        if self.worker.is_alive():
+            logging.warning('%s: poll timed out after %s s', self.name, self.timeout)
+            if self.schedule:
+                self.schedule.failed()
+
+    def call_poll(self):
+        try:
+            with metrics.timer('poll_seconds', self.name):
+                result = self.poll()
+            if self.schedule:
+                self.schedule.polled(*result)
+        except Exception as e:
+            logging.error('%s: poll failed:\n%s', self.name, str(e))
+            if self.schedule:
+                self.schedule.failed(e)
+
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+
+class PollEngine(object):
+    """A set of independently scheduled poll tasks."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, name, poll, interval, timeout=DEFAULT_TIMEOUT, jitter=DEFAULT_JITTER,
+            active=None, schedule=None, until_active=None):
+        task = PollTask(name, poll, interval, timeout, jitter, active, schedule, until_active)
+        self.tasks.append(task)
+        return task
+
+    def start(self):
+        for task in self.tasks:
+            task.start()
+
+    def wake(self, name):
+        """Has the task of the name poll right away."""
+        for task in self.tasks:
+            if task.name == name:
+                task.wake()
+
+    def stop(self):
+        for task in self.tasks:
+            task.stop()
+
+    def join(self):
+        for task in self.tasks:
+            task.join()
@@ -0,0 +1,54 @@
+import http_session
+
+DEFAULT_MIN_INTERVAL = 15
+DEFAULT_MAX_INTERVAL = 900
+BACKOFF_FACTOR = 2
+
+# Statuses meaning "not now", typically with a Retry-After header
+BUSY_STATUSES = (429, 503)
+
+
+class AdaptiveSchedule(object):
+    """Decides how long to wait before polling a source again, based on what
+       the previous polls saw. It polls at the minimum interval right after
+       a change and while a build is running (timed to its expected end),
+       and backs off exponentially, up to the maximum interval, while nothing
+       changes or the server has problems."""
+
+    def __init__(self, base_interval, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, backoff=BACKOFF_FACTOR):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = base_interval
+        self.last_state = None
+
+    def clamp(self, interval):
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def polled(self, state, time_to_finish=None):
+        """Called after a successful poll. The state is anything comparable that
+           summarises the result, e.g. the published statuses. time_to_finish is
+           the seconds until a running build is expected to finish, if any."""
+        if self.last_state is None:
+            interval = self.base_interval
+        elif state != self.last_state:
+            interval = self.min_interval
+        elif time_to_finish is not None:
+            interval = min(time_to_finish, self.base_interval)
+        else:
+            interval = self.interval * self.backoff
+        self.last_state = state
+        self.interval = self.clamp(interval)
+        return self.interval
+
+    def failed(self, error=None):
+        """Called after a failed poll. Honours Retry-After of a busy server."""
+        interval = max(self.interval, self.base_interval) * self.backoff
+        if isinstance(error, http_session.HttpError) and error.status in BUSY_STATUSES:
+            retry_after = error.headers.get('retry-after', '')
+            if retry_after.isdigit():
+                interval = max(interval, int(retry_after))
+        self.interval = self.clamp(interval)
+        return self.interval
@@ -0,0 +1,134 @@
+import BaseHTTPServer
+import SocketServer
+import argparse
+import json
+import logging
+import threading
+import urllib2
+
+import gerrit
+import idle
+import monitor_status
+
+DEFAULT_PORT = 8765
+DEFAULT_RECONCILE_INTERVAL = 900
+
+# Jenkins notification plugin build phases with a result
+COMPLETED_PHASES = ('COMPLETED', 'FINALIZED')
+
+
+def jenkins_job_name(event):
+    """The full job name of a notification, 'folder/job' for jobs in folders
+       (taken from the job url, e.g. 'job/folder/job/name/')."""
+    parts = event.get('url', '').strip('/').split('/')
+    if len(parts) > 2 and parts[0] == 'job':
+        return '/'.join(urllib2.unquote(p) for p in parts[1::2])
+    return event['name']
+
+
+class PushServer(idle.WakeableServerMixIn, SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class PushHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            event = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_error(400, 'Expected JSON')
+            return
+        if self.path.rstrip('/') == '/jenkins':
+            self.server.receiver.jenkins_event(event)
+        elif self.path.rstrip('/') == '/gerrit':
+            self.server.receiver.gerrit_event(event)
+        else:
+            self.send_error(404)
+            return
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug('push: ' + format, *args)
+
+
+class PushReceiver(object):
+    """Receives Jenkins notification plugin webhooks (POST /jenkins) and Gerrit
+       stream-events JSON, e.g. from a local relay (POST /gerrit), and publishes
+       the new panel statuses right away. A Gerrit event that can't be applied to
+       the index calls sync_gerrit, e.g. to have Gerrit polled soon, instead."""
+
+    def __init__(self, jenkins, gerrit_instance, poster, port=DEFAULT_PORT, host='', sync_gerrit=None):
+        self.jenkins = jenkins
+        self.gerrit = gerrit_instance
+        self.poster = poster
+        self.sync_gerrit = sync_gerrit  # Optional, otherwise the next poll catches up
+        self.server = PushServer((host, port), PushHandler)
+        self.server.receiver = self
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='push')
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info('receiving pushed events on port %d', self.server.server_address[1])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def jenkins_groups(self):
+        return ((monitor_status.UPDATE_BUILD_PUBSUB, self.jenkins.build_jobs),
+                (monitor_status.UPDATE_CI_TEST_PUBSUB, self.jenkins.ci_test_jobs),
+                (monitor_status.UPDATE_OTHER_TESTS_PUBSUB, self.jenkins.other_test_jobs))
+
+    def jenkins_event(self, event):
+        build = event.get('build', {})
+        if build.get('phase') not in COMPLETED_PHASES or not build.get('status'):
+            return
+        job = jenkins_job_name(event)
+        logging.debug('pushed: %s %s', job, build['status'])
+        with self.lock:
+            self.jenkins.record_result(job, build['status'], build.get('number'))
+            for (topic, jobs) in self.jenkins_groups():
+                if job in jobs:
+                    self.poster.post_jenkins_status(topic, *self.jenkins.get_known_status(jobs)[:3])
+
+    def gerrit_event(self, event):
+        logging.debug('pushed: gerrit %s', event.get('type'))
+        if event.get('type') not in gerrit.CHANGE_EVENTS:
+            return
+        with self.lock:
+            applied = self.gerrit.apply_event(event)
+            if applied:
+                (gerrit_for_review, gerrit_reviewed) = self.gerrit.indexed_changes()
+                self.poster.post_ready_for_review_status(len(gerrit_for_review))
+                self.poster.post_reviewed_status(len(gerrit_reviewed))
+        # Never query Gerrit here, a burst of events would hold up the handlers
+        if not applied and self.sync_gerrit:
+            self.sync_gerrit()
+
+
+if __name__ == "__main__":
+    # For testing: post an event to a running monitor
+    parser = argparse.ArgumentParser(description='Post a Jenkins or Gerrit event to a Mondrian monitor.')
+    parser.add_argument('url', help='E.g. http://localhost:%d' % DEFAULT_PORT)
+    subparsers = parser.add_subparsers(dest='source')
+    jenkins_parser = subparsers.add_parser('jenkins')
+    jenkins_parser.add_argument('job')
+    jenkins_parser.add_argument('status', help='E.g. SUCCESS or FAILURE')
+    gerrit_parser = subparsers.add_parser('gerrit')
+    gerrit_parser.add_argument('event_file', help='A file with a stream-events JSON event')
+    args = parser.parse_args()
+
+    if args.source == 'jenkins':
+        event = {'name': args.job,
+                 'build': {'phase': 'COMPLETED', 'status': args.status}}
+    else:
+        with open(args.event_file) as event_file:
+            event = json.load(event_file)
+    req = urllib2.Request('%s/%s' % (args.url.rstrip('/'), args.source), json.dumps(event),
+                          {'Content-Type': 'application/json'})
+    print urllib2.urlopen(req).getcode()
@@ -0,0 +1,134 @@
+import httplib
+import logging
+import random
+import socket
+import threading
+import time
+
+import http_session
+import metrics
+
+DEFAULT_DEADLINE = 45  # Seconds for a whole poll of a source, retries included
+DEFAULT_ATTEMPTS = 3
+BASE_DELAY = 1.0
+MAX_DELAY = 10.0
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 120
+DEFAULT_STALE_AFTER = 600
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+
+    def __init__(self, name):
+        Exception.__init__(self, '%s is failing, not asking it for now' % name)
+        self.name = name
+
+
+def is_transient(error):
+    """Whether a failed request is worth retrying."""
+    if isinstance(error, http_session.DeadlineExceeded):
+        return False
+    if isinstance(error, http_session.HttpError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (socket.error, httplib.HTTPException))
+
+
+def retry(func, attempts=DEFAULT_ATTEMPTS, deadline=None, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Calls func until it succeeds, at most attempts times, for transient errors
+       only. Waits a random time up to an exponentially growing delay between the
+       attempts (full jitter), and gives up rather than wait past the deadline."""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if deadline is not None and time.time() + delay >= deadline:
+                raise
+            logging.debug('retrying in %.1f s after: %s', delay, str(e))
+            time.sleep(delay)
+
+
+class CircuitBreaker(object):
+    """Stops calling a source after failure_threshold failures in a row. After
+       reset_timeout seconds one call is let through as a probe: if it succeeds
+       the source is used again, otherwise it waits another reset_timeout.
+       With failure_threshold None, it never stops calling."""
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened >= self.reset_timeout:
+                self.state = HALF_OPEN  # Only this caller probes
+                return True
+            return False
+
+    def succeeded(self):
+        with self.lock:
+            if self.state != CLOSED:
+                logging.info('%s is back', self.name)
+            self.state = CLOSED
+            self.failures = 0
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    (self.failure_threshold is not None and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    logging.warning('%s failed %d times, pausing it', self.name, self.failures)
+                    metrics.count('circuit_opened', label=self.name)
+                self.state = OPEN
+                self.opened = time.time()
+
+
+class SourceGuard(object):
+    """Polls one source (e.g. Jenkins) within a deadline, with retries, behind a
+       circuit breaker, and remembers when it last succeeded."""
+
+    def __init__(self, name, session=None, deadline=DEFAULT_DEADLINE, attempts=DEFAULT_ATTEMPTS,
+                 breaker=None, stale_after=DEFAULT_STALE_AFTER):
+        self.name = name
+        self.session = session
+        self.deadline = deadline
+        self.attempts = attempts
+        self.breaker = breaker or CircuitBreaker(name)
+        self.stale_after = stale_after
+        self.last_success = None  # Not polled successfully yet
+
+    def call(self, func):
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.name)
+        try:
+            if self.session:
+                with self.session.deadline(self.deadline):
+                    result = retry(func, self.attempts, time.time() + self.deadline)
+            else:
+                result = retry(func, self.attempts, time.time() + self.deadline)
+        except Exception:
+            self.breaker.failed()
+            raise
+        self.breaker.succeeded()
+        self.last_success = time.time()
+        return result
+
+    def is_stale(self):
+        """Whether the source has not been polled successfully for stale_after
+           seconds, or not yet at all."""
+        return self.last_success is None or time.time() - self.last_success > self.stale_after
@@ -0,0 +1,116 @@
+import collections
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 500
+
+
+class CacheEntry(object):
+
+    def __init__(self, parsed, etag=None, last_modified=None, version=None):
+        self.parsed = parsed
+        self.etag = etag
+        self.last_modified = last_modified
+        self.version = version
+        self.fetched = time.time()
+
+
+class ResponseCache(object):
+    """Caches parsed responses per URL. Responses younger than the TTL of their
+       endpoint are reused as they are, older ones are revalidated with a
+       conditional request, and on 304 Not Modified the parsed object is reused.
+       Responses that can be neither reused nor revalidated are not kept. The
+       least recently used entries are evicted beyond max_entries."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = ttls or {}  # URL substring -> seconds
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+
+    def ttl_for(self, url):
+        ttl = 0
+        for (endpoint, seconds) in self.ttls.items():
+            if endpoint in url:
+                ttl = max(ttl, seconds)
+        return ttl
+
+    def fetch(self, session, url, parse, headers=None, version=None, stream=False):
+        """Returns parse(body) of url, from the cache when possible. An entry
+           stored with the same version (e.g. a change's 'updated' time) is
+           reused without any request. With stream, parse gets the chunks of the
+           body as they arrive instead, see HttpSession.get, and only what it
+           returns is kept."""
+        consume = parse if stream else None
+        entry = self.get(url)
+        if entry and ((version is not None and version == entry.version) or
+                      time.time() - entry.fetched < self.ttl_for(url)):
+            with self.lock:
+                self.hits += 1
+            return entry.parsed
+
+        all_headers = dict(headers or {})
+        if entry and entry.etag:
+            all_headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            all_headers['If-Modified-Since'] = entry.last_modified
+        res = session.get(url, all_headers, consume)
+        if res.status == 304:
+            if entry:
+                entry.fetched = time.time()
+                entry.version = version
+                with self.lock:
+                    self.not_modified += 1
+                return entry.parsed
+            res = session.get(url, headers, consume)  # Evicted meanwhile, ask again
+
+        parsed = res.body if stream else parse(res.body)
+        etag = res.headers.get('etag')
+        last_modified = res.headers.get('last-modified')
+        if etag or last_modified or version is not None or self.ttl_for(url) > 0:
+            # Others could never spare a request, e.g. the incremental Gerrit queries
+            self.put(url, CacheEntry(parsed, etag, last_modified, version))
+        with self.lock:
+            self.misses += 1
+        return parsed
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry:
+                self.entries[url] = entry  # Most recently used last
+            return entry
+
+    def put(self, url, entry):
+        with self.lock:
+            self.entries.pop(url, None)
+            self.entries[url] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def export(self, max_entries=None):
+        """The entries that can spare a request or be revalidated (with an ETag,
+           Last-Modified or version) as a JSON friendly list, least recently used
+           first. With max_entries, only that many of the most recently used."""
+        with self.lock:
+            entries = [[url, e.parsed, e.etag, e.last_modified, e.version, e.fetched]
+                       for (url, e) in self.entries.items()
+                       if e.etag or e.last_modified or e.version is not None]
+        return entries[-max_entries:] if max_entries else entries
+
+    def restore(self, exported):
+        """Adds entries from export(), e.g. from a previous run."""
+        for (url, parsed, etag, last_modified, version, fetched) in exported:
+            entry = CacheEntry(parsed, etag, last_modified, version)
+            entry.fetched = fetched
+            self.put(url, entry)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries),
+                    'hits': self.hits,
+                    'not_modified': self.not_modified,
+                    'misses': self.misses}
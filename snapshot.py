@@ -0,0 +1,122 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import federation
+import monitor_status
+
+SNAPSHOT_FORMAT = 3  # 3: the cached responses are the compact results of the streaming parsers
+DEFAULT_FILE = 'mondrian_snapshot.json.gz'
+DEFAULT_MAX_AGE = 3600  # Older panel states are shown as unknown
+MIN_SAVE_INTERVAL = 30
+MAX_CACHE_ENTRIES = 100  # The most recently used responses worth saving
+
+
+def write_atomically(file_name, data):
+    """Writes data as gzipped JSON to a temporary file next to file_name, and
+       then renames it, so that a crash never leaves half a snapshot."""
+    directory = os.path.dirname(os.path.abspath(file_name))
+    (fd, temp_name) = tempfile.mkstemp(prefix='.snapshot', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            with gzip.GzipFile(fileobj=temp_file, mode='wb') as gzip_file:
+                json.dump(data, gzip_file, separators=(',', ':'))
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.rename(temp_name, file_name)
+    except Exception:
+        os.remove(temp_name)
+        raise
+
+
+def read(file_name):
+    """Returns the snapshot data, or None if there is no usable snapshot."""
+    try:
+        with gzip.open(file_name, 'rb') as gzip_file:
+            data = json.load(gzip_file)
+    except (IOError, ValueError) as e:
+        if os.path.exists(file_name):
+            logging.warning('ignoring unreadable snapshot %s:\n%s', file_name, str(e))
+        return None
+    if data.get('format') != SNAPSHOT_FORMAT:
+        return None
+    return data
+
+
+class Snapshot(object):
+    """The panel states, the Gerrit index, the latest job results and the most
+       recently used cached responses that can be revalidated, saved to disk after
+       the polls, and restored at startup. The panels can then be painted right
+       away, and the first poll only asks for what has changed since."""
+
+    def __init__(self, store, jenkins, gerrit_instance, cache, file_name=DEFAULT_FILE,
+                 max_age=DEFAULT_MAX_AGE):
+        self.store = store
+        self.jenkins = jenkins
+        self.gerrit = gerrit_instance
+        self.cache = cache
+        self.file_name = file_name
+        self.max_age = max_age
+        self.saved = 0
+        self.lock = threading.Lock()
+
+    def collect(self):
+        gerrit_data = []
+        for gerrit_instance in federation.sources(self.gerrit):
+            with gerrit_instance.index_lock:
+                index = gerrit_instance.index
+                changes = dict((change_id, list(change)) for (change_id, change) in index.changes.items())
+                gerrit_data.append({'changes': changes,
+                                    'last_sync': index.last_sync,
+                                    'last_full_sync': index.last_full_sync})
+        return {'format': SNAPSHOT_FORMAT,
+                'saved': time.time(),
+                'panels': self.store.get_states()[1],
+                'jenkins': [{'latest': dict(jenkins.latest)} for jenkins in federation.sources(self.jenkins)],
+                'gerrit': gerrit_data,
+                'cache': self.cache.export(MAX_CACHE_ENTRIES)}
+
+    def save(self, force=False):
+        """Saves the snapshot, unless one was saved less than MIN_SAVE_INTERVAL ago."""
+        with self.lock:
+            if not force and time.time() - self.saved < MIN_SAVE_INTERVAL:
+                return
+            try:
+                write_atomically(self.file_name, self.collect())
+                self.saved = time.time()
+            except (IOError, OSError) as e:
+                logging.warning('could not save snapshot %s:\n%s', self.file_name, str(e))
+
+    def restore(self):
+        """Seeds the caches and publishes the saved panel states, as unknown if
+           the snapshot is older than max_age. Returns True if there was a snapshot."""
+        data = read(self.file_name)
+        if data is None:
+            return False
+        age = time.time() - data['saved']
+        logging.info('restoring snapshot from %d s ago', age)
+        for (topic, status) in data['panels'].items():
+            if age > self.max_age:
+                status = monitor_status.STATUS_UNKNOWN
+            self.store.publish(str(topic), status=status)
+
+        # The servers are in the order of mondrian.json; if it has changed, only the panels are restored
+        jenkins_instances = federation.sources(self.jenkins)
+        if len(jenkins_instances) == len(data['jenkins']):
+            for (jenkins, jenkins_data) in zip(jenkins_instances, data['jenkins']):
+                jenkins.latest.update(jenkins_data['latest'])
+        gerrit_instances = federation.sources(self.gerrit)
+        if len(gerrit_instances) == len(data['gerrit']):
+            for (gerrit_instance, gerrit_data) in zip(gerrit_instances, data['gerrit']):
+                with gerrit_instance.index_lock:
+                    index = gerrit_instance.index
+                    index.changes = dict((change_id, tuple(change))
+                                         for (change_id, change) in gerrit_data['changes'].items())
+                    index.last_sync = gerrit_data['last_sync']
+                    index.last_full_sync = gerrit_data['last_full_sync']
+        self.cache.restore(data['cache'])
+        return True
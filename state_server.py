@@ -0,0 +1,126 @@
+import BaseHTTPServer
+import SocketServer
+import json
+import logging
+import threading
+import urlparse
+
+import http_session
+import idle
+import monitor_status
+import panel_state
+
+DEFAULT_PORT = 8766
+LONG_POLL_TIMEOUT = 30
+RETRY_SECONDS = 10
+START_DELAY = 2  # Just to give the view time to subscribe
+
+
+class PanelStates(panel_state.PanelStateStore):
+    """The panel states of a poller daemon. Subscribers wait for anything newer
+       than the version they have."""
+
+    def __init__(self):
+        panel_state.PanelStateStore.__init__(self)
+        self.shutdown_requested = threading.Event()
+        self.next_change = idle.event()  # Set on the next change, and then replaced
+
+    def publish(self, topic, **kwargs):
+        """Works as the publish function of a StatusPoster."""
+        if topic == monitor_status.SHUTDOWN_PUBSUB:
+            self.shutdown_requested.set()
+            return False
+        if not panel_state.PanelStateStore.publish(self, topic, **kwargs):
+            return False
+        with self.changed:
+            (next_change, self.next_change) = (self.next_change, idle.event())
+        next_change.set()
+        return True
+
+    def wait(self, since, timeout=LONG_POLL_TIMEOUT):
+        """Returns (version, states) as soon as the version is newer than since,
+           or after the timeout. Sleeps on next_change meanwhile, as the condition
+           would wake up every 50 ms."""
+        with self.changed:
+            if self.version > since:
+                return (self.version, dict(self.states))
+            next_change = self.next_change
+        next_change.wait(timeout)
+        return self.get_states()
+
+
+class StateServer(idle.WakeableServerMixIn, SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, states, port=DEFAULT_PORT, host=''):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), StateHandler)
+        self.states = states
+
+
+class StateHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """GET /state returns the panel states at once, GET /state?since=<version>
+       when there is anything newer (long poll)."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path.rstrip('/') != '/state':
+            self.send_error(404)
+            return
+        query = urlparse.parse_qs(url.query)
+        try:
+            since = int(query['since'][0]) if 'since' in query else -1
+        except ValueError:
+            self.send_error(400, 'Bad version')
+            return
+        (version, states) = self.server.states.wait(since)
+        body = json.dumps({'version': version, 'panels': states})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('state: ' + format, *args)
+
+
+class StateSubscriber(threading.Thread):
+    """Takes the panel states from a Mondrian poller daemon, instead of polling
+       Jenkins and Gerrit, and publishes them to the view. With working_hours,
+       it sleeps outside of them, as the view does."""
+
+    def __init__(self, url, publish=monitor_status.send_to_view, working_hours=None):
+        threading.Thread.__init__(self, name='subscriber')
+        self.daemon = True  # Don't wait for an ongoing long poll at exit
+        self.url = url.rstrip('/')
+        self.publish = publish
+        self.working_hours = working_hours
+        self.session = http_session.HttpSession(read_timeout=LONG_POLL_TIMEOUT + 10)
+        self.stopped = idle.event()
+        self.start()
+
+    def run(self):
+        version = -1
+        self.stopped.wait(START_DELAY)
+        while not self.stopped.is_set():
+            if self.working_hours and not self.working_hours.is_working():
+                self.stopped.wait(self.working_hours.seconds_until_change())
+                continue
+            try:
+                res = self.session.get('%s/state?since=%d' % (self.url, version))
+                data = json.loads(res.body)
+            except Exception as e:
+                logging.warning('subscription failed, retrying:\n%s', str(e))
+                self.stopped.wait(RETRY_SECONDS)
+                continue
+            if data['version'] != version:
+                version = data['version']
+                for (topic, status) in data['panels'].items():
+                    self.publish(str(topic), status=status)
+        self.session.close()
+        logging.debug('done subscribing')
+
+    def stop(self):
+        self.stopped.set()
+        self.join(1)
@@ -0,0 +1,66 @@
+import datetime
+
+DEFAULT_DAYS = (1, 2, 3, 4, 5)  # ISO weekdays, Monday to Friday
+DEFAULT_START = '06:00'
+DEFAULT_END = '18:00'
+DAYS_AHEAD = 400  # How far to look for the next working day, past any holidays
+
+
+def parse_time(text):
+    (hour, minute) = text.split(':')
+    return datetime.time(int(hour), int(minute))
+
+
+def parse_date(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+
+class WorkingHours(object):
+    """The working hours, from start to end (local time, "HH:MM") on the days
+       (ISO weekdays, 1 is Monday), except on the holidays ("YYYY-MM-DD")."""
+
+    def __init__(self, days=DEFAULT_DAYS, start=DEFAULT_START, end=DEFAULT_END, holidays=()):
+        self.days = set(days)
+        self.start = parse_time(start)
+        self.end = parse_time(end)
+        if self.start >= self.end:
+            raise ValueError('working hours end at %s, before they start at %s' % (end, start))
+        self.holidays = set(parse_date(holiday) for holiday in holidays)
+
+    def is_working_day(self, date):
+        return date.isoweekday() in self.days and date not in self.holidays
+
+    def is_working(self, now=None):
+        now = now or datetime.datetime.now()
+        return self.is_working_day(now.date()) and self.start <= now.time() < self.end
+
+    def next_change(self, now=None):
+        """When the working hours next start or end, or None if there are none."""
+        now = now or datetime.datetime.now()
+        if self.is_working(now):
+            return datetime.datetime.combine(now.date(), self.end)
+        date = now.date()
+        for _ in range(DAYS_AHEAD):
+            start = datetime.datetime.combine(date, self.start)
+            if self.is_working_day(date) and start > now:
+                return start
+            date += datetime.timedelta(days=1)
+        return None
+
+    def seconds_until_change(self, now=None):
+        """Seconds until the working hours next start or end, None if never."""
+        now = now or datetime.datetime.now()
+        change = self.next_change(now)
+        if change is None:
+            return None
+        return max(0, (change - now).total_seconds())
+
+
+def create(working_hours_data):
+    """WorkingHours configured like {"days": [1, 2, 3, 4, 5], "start": "06:00",
+       "end": "18:00", "holidays": ["2026-12-24"]}, all optional."""
+    working_hours_data = working_hours_data or {}
+    return WorkingHours(days=working_hours_data.get('days', DEFAULT_DAYS),
+                        start=working_hours_data.get('start', DEFAULT_START),
+                        end=working_hours_data.get('end', DEFAULT_END),
+                        holidays=working_hours_data.get('holidays', ()))